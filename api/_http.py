@@ -0,0 +1,34 @@
+# Response header sets, as (name, value) pairs for send_headers
+JSON_HEADERS = (
+    ("Content-Type", "application/json"),
+    ("Access-Control-Allow-Origin", "*"),
+)
+PREFLIGHT_HEADERS = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "POST, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type"),
+)
+
+def send_headers(handler, status_code, headers):
+    """Send the status line and the given headers, then end the header block"""
+    handler.send_response(status_code)
+    for name, value in headers:
+        handler.send_header(name, value)
+    handler.end_headers()
+
+def send_json(handler, status_code, payload, extra_headers=()):
+    """Send an already-serialized JSON body with its length and any extra headers"""
+    send_headers(handler, status_code, JSON_HEADERS + (("Content-Length", str(len(payload))),) + extra_headers)
+    handler.wfile.write(payload)
+
+def read_body(rfile, content_length):
+    """Read the request body into a preallocated bytearray"""
+    buf = bytearray(content_length)
+    view = memoryview(buf)
+    received = 0
+    while received < content_length:
+        n = rfile.readinto(view[received:])
+        if not n:
+            raise Exception(f"Request body truncated: got {received} of {content_length} bytes")
+        received += n
+    return buf
@@ -0,0 +1,64 @@
+import email.policy
+from email.parser import BytesFeedParser
+import orjson
+
+# Upper bound on file entries per field when 'data' doesn't declare them,
+# so a field name like 'images[100000000]' can't make us allocate millions
+# of placeholder entries
+MAX_UPLOAD_ENTRIES = 256
+
+class MultipartError(ValueError):
+    """A multipart upload that is malformed or out of bounds (a client error)"""
+
+def parse_multipart(content_type, body, file_keys):
+    """
+    Parse a multipart/form-data upload into the same shape as the JSON body.
+    The 'data' field carries the JSON fields; file fields named like
+    'audio_files[0]' supply the raw bytes for that entry, replacing base64.
+    """
+    # Feed the header and the body separately, so the upload is not copied
+    # into a bytes object and then again into one concatenated buffer
+    parser = BytesFeedParser(policy=email.policy.HTTP)
+    parser.feed(b"Content-Type: " + content_type.encode('latin-1') + b"\r\n\r\n")
+    parser.feed(body)
+    message = parser.close()
+    if not message.is_multipart():
+        raise MultipartError("Malformed multipart body")
+
+    data = {}
+    uploads = []
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True)
+        if name == "data":
+            data = orjson.loads(payload)
+            if not isinstance(data, dict):
+                raise MultipartError("'data' field must be a JSON object")
+        elif name:
+            uploads.append((name, payload))
+
+    # Entries declared in 'data' fix each field's length; otherwise allow up to the cap
+    limits = {
+        field: len(data[field]) if isinstance(data.get(field), list) and data[field] else MAX_UPLOAD_ENTRIES
+        for field in file_keys
+    }
+    for name, payload in uploads:
+        field, _, index = name.partition("[")
+        if field not in file_keys or not index.endswith("]"):
+            continue
+        entries = data.setdefault(field, [])
+        if not isinstance(entries, list):
+            raise MultipartError(f"'{field}' must be an array")
+        try:
+            i = int(index[:-1])
+        except ValueError:
+            raise MultipartError(f"Invalid index in file field '{name}'")
+        limit = limits[field]
+        if not 0 <= i < limit:
+            raise MultipartError(f"File field '{name}' is out of range (max index {limit - 1})")
+        while len(entries) <= i:
+            entries.append({})
+        if not isinstance(entries[i], dict):
+            raise MultipartError(f"'{field}[{i}]' must be an object")
+        entries[i][file_keys[field]] = payload
+    return data
@@ -1,19 +1,87 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import orjson
 import base64
-import io
+import pybase64
 import sys
 import os
 import tempfile
-import imageio
+import subprocess
+import re
+import imageio_ffmpeg
+from api._multipart import parse_multipart, MultipartError
+from api._http import JSON_HEADERS, PREFLIGHT_HEADERS, read_body, send_headers
+
+# SIMD base64 only pays off once the kernel setup cost is amortized; tiny
+# payloads are faster through the stdlib codec.
+_B64_SIMD_MIN_DECODE = 1024
+_B64_SIMD_MIN_ENCODE = 1000
+
+def _b64decode(s):
+    """Decode base64, using pybase64 for large inputs"""
+    if len(s) >= _B64_SIMD_MIN_DECODE:
+        return pybase64.b64decode(s)
+    return base64.b64decode(s)
+
+def _b64encode(b):
+    """
+    Encode bytes to base64, using pybase64 for large inputs.
+    Returns ASCII bytes so the response writer can send them without a copy.
+    """
+    if len(b) >= _B64_SIMD_MIN_ENCODE:
+        return pybase64.b64encode(b)
+    return base64.b64encode(b)
+
+# Responses are written in pieces; anything smaller than this is coalesced
+# into one socket write, anything larger is written as-is.
+_RESPONSE_WRITE_CHUNK = 64 * 1024
+
+def _iter_json(value):
+    """
+    Yield the JSON encoding of value in pieces. bytes values must already be
+    JSON-safe ASCII (base64) and are yielded untouched, so multi-MB payloads
+    are never copied into one big JSON string.
+    """
+    if isinstance(value, bytes):
+        yield b'"'
+        yield value
+        yield b'"'
+    elif isinstance(value, dict):
+        yield b'{'
+        for i, (key, item) in enumerate(value.items()):
+            yield (b', ' if i else b'') + json.dumps(key).encode('utf-8') + b': '
+            yield from _iter_json(item)
+        yield b'}'
+    elif isinstance(value, list):
+        yield b'['
+        for i, item in enumerate(value):
+            if i:
+                yield b', '
+            yield from _iter_json(item)
+        yield b']'
+    else:
+        yield json.dumps(value).encode('utf-8')
+
+# Output size limit (keeps the base64 response under Vercel's payload limit)
+_MAX_VIDEO_BYTES = 10 * 1024 * 1024
+
+# Matches the stream lines of ffmpeg's input summary, e.g.
+# "Stream #0:0[0x1](und): Video: h264 (High) ..., 1080x1920, 59 kb/s, 30 fps"
+_STREAM_LINE = re.compile(r"Stream #\d+:\d+.*?: (Video|Audio): (.*)")
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            body = read_body(self.rfile, content_length)
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("multipart/"):
+                # Raw binary uploads skip base64 entirely
+                data = parse_multipart(content_type, body, {"video_files": "video"})
+            else:
+                # orjson parses the bytearray directly, without a str copy
+                data = orjson.loads(body)
             
             # Validate input
             if "video_files" not in data:
@@ -31,6 +99,9 @@ class handler(BaseHTTPRequestHandler):
             try:
                 # Create long video by concatenating all parts
                 video_data = self.concatenate_videos(video_files)
+                if video_data["size"] > _MAX_VIDEO_BYTES:
+                    self.send_error_response(413, f"Combined video is {video_data['size']} bytes even after re-encoding, over the {_MAX_VIDEO_BYTES} byte limit. Use fewer or shorter parts.")
+                    return
                 
                 response_data = {
                     "video": video_data["video"],
@@ -51,6 +122,8 @@ class handler(BaseHTTPRequestHandler):
             
         except json.JSONDecodeError as e:
             self.send_error_response(400, f"Invalid JSON: {str(e)}")
+        except MultipartError as e:
+            self.send_error_response(400, f"Invalid upload: {str(e)}")
         except Exception as e:
             self.send_error_response(500, f"Unexpected error: {str(e)}")
     
@@ -65,69 +138,54 @@ class handler(BaseHTTPRequestHandler):
         
         try:
             for i, video_data in enumerate(video_files):
-                video_bytes = base64.b64decode(video_data["video"])
-                
-                # Save to temporary file
+                # Decode each part in one call (the codec skips line breaks and
+                # other whitespace) and write it to a temporary file
                 temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-                temp_file.write(video_bytes)
+                if isinstance(video_data["video"], bytes):
+                    temp_file.write(video_data["video"])
+                else:
+                    temp_file.write(_b64decode(video_data["video"]))
                 temp_file.close()
                 
                 video_paths.append(temp_file.name)
                 temp_files.append(temp_file.name)
             
-            # Create output file
-            output_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-            output_path = output_file.name
-            output_file.close()
-            
-            # Concatenate videos using imageio (requires FFmpeg)
-            # Note: This is a simplified approach - in production you'd use FFmpeg directly
+            # Concatenate videos with ffmpeg's concat demuxer (requires FFmpeg)
             try:
-                # Read all video frames
-                all_frames = []
-                fps = 30  # Assume 30 fps
-                total_duration = 0
                 width, height = 1080, 1920
                 
-                for video_path in video_paths:
-                    try:
-                        # Read video frames
-                        reader = imageio.get_reader(video_path, fps=fps)
-                        for frame in reader:
-                            all_frames.append(frame)
-                        reader.close()
-                        
-                        # Estimate duration (frames / fps)
-                        # We'll use the duration from the video_data if available
-                        pass
-                    except Exception as e:
-                        print(f"Error reading video {video_path}: {str(e)}", file=sys.stderr)
-                        # Continue with other videos
-                        continue
-                
                 # Calculate total duration
                 total_duration = sum(vf.get("duration", 0) for vf in video_files)
                 
-                # Write concatenated video
-                if all_frames:
-                    imageio.mimwrite(output_path, all_frames, fps=fps, codec='libx264', quality=8)
-                else:
-                    raise Exception("No frames to write")
+                # Every part comes out of create_videos with the same codec,
+                # resolution and frame rate, so the streams can be copied
+                # into one container without decoding or re-encoding
+                list_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
+                temp_files.append(list_file.name)
+                for video_path in video_paths:
+                    list_file.write(f"file '{video_path}'\n")
+                list_file.close()
                 
-                # Read final video
-                with open(output_path, 'rb') as f:
-                    final_video_bytes = f.read()
+                # Parts that don't share codec parameters (e.g. uploaded from
+                # elsewhere) can't be stream-copied; let ffmpeg decode and
+                # re-encode them natively instead
+                signatures = {self.stream_signature(path) for path in video_paths}
+                if len(signatures) == 1:
+                    final_video_bytes = self.concat_copy(list_file.name)
+                else:
+                    print("Parts have mismatched streams, re-encoding", file=sys.stderr)
+                    final_video_bytes = self.concat_reencode(list_file.name, width, height)
                 
-                # Optimize if too large
-                if len(final_video_bytes) > 10 * 1024 * 1024:  # 10MB
-                    # Re-encode with lower quality
+                # Optimize if too large: re-encode with the bitrate capped
+                # at the size budget
+                if len(final_video_bytes) > _MAX_VIDEO_BYTES:
                     print("Video too large, re-encoding with lower quality...", file=sys.stderr)
-                    imageio.mimwrite(output_path, all_frames, fps=fps, codec='libx264', quality=6)
-                    with open(output_path, 'rb') as f:
-                        final_video_bytes = f.read()
+                    # Leave 10% headroom for container overhead and rate-control overshoot
+                    max_kbps = max(100, int(_MAX_VIDEO_BYTES * 8 * 0.9 / max(total_duration, 1.0) / 1000))
+                    final_video_bytes = self.concat_reencode(list_file.name, width, height, max_kbps=max_kbps)
                 
                 # Convert to base64
-                video_base64 = base64.b64encode(final_video_bytes).decode('utf-8')
+                video_base64 = _b64encode(final_video_bytes)
                 
                 return {
                     "video": video_base64,
@@ -144,33 +202,89 @@ class handler(BaseHTTPRequestHandler):
             
         finally:
             # Clean up temporary files
-            for temp_file in temp_files + [output_path]:
+            for temp_file in temp_files:
                 try:
                     os.unlink(temp_file)
                 except:
                     pass
     
+    def stream_signature(self, path):
+        """
+        Describe a file's streams (codec, pixel format, size, rate) from
+        ffmpeg's input summary, ignoring per-file fields such as bitrate.
+        """
+        # Without an output ffmpeg only prints the input summary and exits
+        result = subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-i', path],
+            capture_output=True
+        )
+        signature = []
+        for match in _STREAM_LINE.finditer(result.stderr.decode('utf-8', 'replace')):
+            fields = [field.strip() for field in match.group(2).split(',') if 'kb/s' not in field]
+            signature.append((match.group(1), tuple(fields)))
+        return tuple(signature)
+    
+    def concat_copy(self, list_path):
+        """
+        Stream-copy the files listed in a concat list into one MP4.
+        ffmpeg writes fragmented MP4 to stdout, which is returned as bytes.
+        """
+        result = subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-v', 'error',
+             '-f', 'concat', '-safe', '0', '-i', list_path,
+             '-c', 'copy', '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov', 'pipe:1'],
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg concat failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
+    
+    def concat_reencode(self, list_path, width, height, max_kbps=None):
+        """
+        Decode and re-encode the files listed in a concat list into one MP4,
+        normalizing every part to width x height at 30 fps. With max_kbps the
+        video bitrate is capped and quality lowered to fit a size budget.
+        """
+        scale = (
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps=30"
+        )
+        rate_params = ['-crf', '23']
+        if max_kbps:
+            rate_params = ['-crf', '30', '-maxrate', f'{max_kbps}k', '-bufsize', f'{max_kbps * 2}k']
+        result = subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-v', 'error',
+             '-f', 'concat', '-safe', '0', '-i', list_path,
+             '-vf', scale, '-c:v', 'libx264', '-preset', 'veryfast'] + rate_params + [
+             '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+             '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov', 'pipe:1'],
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg re-encode failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
+    
     def send_success_response(self, data):
-        """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        """Send successful JSON response, streaming large base64 fields"""
+        send_headers(self, 200, JSON_HEADERS)
+        
+        pending = bytearray()
+        for piece in _iter_json(data):
+            if len(piece) < _RESPONSE_WRITE_CHUNK:
+                pending += piece
+                continue
+            if pending:
+                self.wfile.write(pending)
+                pending.clear()
+            self.wfile.write(piece)
+        self.wfile.write(pending)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
+        send_headers(self, status_code, JSON_HEADERS)
         self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
+        send_headers(self, 200, PREFLIGHT_HEADERS)
 
@@ -1,20 +1,130 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import orjson
 import base64
+import pybase64
 import io
 import sys
 import os
 import tempfile
+import subprocess
+import textwrap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
-import imageio
+import imageio_ffmpeg
+from api._multipart import parse_multipart, MultipartError
+from api._http import JSON_HEADERS, PREFLIGHT_HEADERS, read_body, send_headers
+
+# SIMD base64 only pays off once the kernel setup cost is amortized; tiny
+# payloads are faster through the stdlib codec.
+_B64_SIMD_MIN_DECODE = 1024
+_B64_SIMD_MIN_ENCODE = 1000
+
+def _b64decode(s):
+    """Decode base64, using pybase64 for large inputs"""
+    if len(s) >= _B64_SIMD_MIN_DECODE:
+        return pybase64.b64decode(s)
+    return base64.b64decode(s)
+
+def _b64encode(b):
+    """
+    Encode bytes to base64, using pybase64 for large inputs.
+    Returns ASCII bytes so the response writer can send them without a copy.
+    """
+    if len(b) >= _B64_SIMD_MIN_ENCODE:
+        return pybase64.b64encode(b)
+    return base64.b64encode(b)
+
+def _as_bytes(value):
+    """Return raw bytes for a field that was either uploaded raw or as base64"""
+    if isinstance(value, bytes):
+        return value
+    return _b64decode(value)
+
+def _load_subtitle_font():
+    """Load the subtitle font, falling back to the default if not available"""
+    try:
+        # Try to use a system font
+        font_size = 48
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
+    except:
+        try:
+            return ImageFont.load_default()
+        except:
+            return None
+
+# Parsed once per process rather than on every subtitle render
+_SUBTITLE_FONT = _load_subtitle_font()
+
+# Responses are written in pieces; anything smaller than this is coalesced
+# into one socket write, anything larger is written as-is.
+_RESPONSE_WRITE_CHUNK = 64 * 1024
+
+def _iter_json(value):
+    """
+    Yield the JSON encoding of value in pieces. bytes values must already be
+    JSON-safe ASCII (base64) and are yielded untouched, so multi-MB payloads
+    are never copied into one big JSON string.
+    """
+    if isinstance(value, bytes):
+        yield b'"'
+        yield value
+        yield b'"'
+    elif isinstance(value, dict):
+        yield b'{'
+        for i, (key, item) in enumerate(value.items()):
+            yield (b', ' if i else b'') + json.dumps(key).encode('utf-8') + b': '
+            yield from _iter_json(item)
+        yield b'}'
+    elif isinstance(value, list):
+        yield b'['
+        for i, item in enumerate(value):
+            if i:
+                yield b', '
+            yield from _iter_json(item)
+        yield b']'
+    else:
+        yield json.dumps(value).encode('utf-8')
+
+# Per-part output size limit (keeps responses under Vercel's payload limit)
+_MAX_VIDEO_BYTES = 3 * 1024 * 1024
+
+def _size_capped_x264_params(duration, max_bytes, crf=23):
+    """
+    x264 options for a single-pass encode aimed at max_bytes: constant
+    quality (CRF) with the bitrate capped at the size budget. The VBV cap is
+    only a target, so callers still check the encoded size.
+    """
+    # Leave 10% headroom for container overhead and rate-control overshoot
+    max_kbps = max(100, int(max_bytes * 8 * 0.9 / max(duration, 1.0) / 1000))
+    return ['-crf', str(crf), '-preset', 'veryfast',
+            '-maxrate', f'{max_kbps}k', '-bufsize', f'{max_kbps * 2}k']
+
+# Number of processes used to encode a batch's parts in parallel. Defaults
+# to 1 (serial) because Vercel's free tier runs on a single vCPU; set
+# VIDEO_WORKERS on multi-core deployments.
+_VIDEO_WORKERS = max(1, int(os.environ.get("VIDEO_WORKERS", "1")))
+
+def _create_video_worker(audio_data, image_data, subtitle_text, part_number):
+    """Process pool entry point: create one part's video"""
+    # create_video never touches the request or socket, so a bare,
+    # uninitialized handler instance is enough to call it
+    return handler.create_video(handler.__new__(handler), audio_data, image_data, subtitle_text, part_number)
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            body = read_body(self.rfile, content_length)
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("multipart/"):
+                # Raw binary uploads skip base64 entirely
+                data = parse_multipart(content_type, body, {"audio_files": "audio", "image_files": "image"})
+            else:
+                # orjson parses the bytearray directly, without a str copy
+                data = orjson.loads(body)
             
             # Validate input
             if "audio_files" not in data or "image_files" not in data or "translated_parts" not in data:
@@ -38,32 +148,56 @@ class handler(BaseHTTPRequestHandler):
             
             print(f"Creating videos for batch {batch_index + 1}: parts {start_idx + 1} to {end_idx} of {len(audio_files)}", file=sys.stderr)
             
-            # Create videos for batch
+            # Create videos for batch. Parts are independent, so when
+            # VIDEO_WORKERS allows it they are encoded in parallel processes.
             video_batch = []
+            workers = min(_VIDEO_WORKERS, len(batch_range))
+            executor = None
+            if workers > 1:
+                # fork lets workers inherit the already-loaded handler module
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
             
-            for i in batch_range:
-                actual_index = i
+            try:
+                futures = {}
+                if executor:
+                    for i in batch_range:
+                        futures[i] = executor.submit(
+                            _create_video_worker,
+                            audio_files[i],
+                            image_files[i],
+                            translated_parts[i],
+                            i + 1
+                        )
                 
-                try:
-                    print(f"Creating video for part {actual_index + 1}/{len(audio_files)}...", file=sys.stderr)
-                    video_data = self.create_video(
-                        audio_files[actual_index],
-                        image_files[actual_index],
-                        translated_parts[actual_index],
-                        actual_index + 1
-                    )
-                    video_batch.append(video_data)
-                    print(f"Part {actual_index + 1} video created: {video_data['duration']:.1f}s, {video_data['size']} bytes", file=sys.stderr)
-                except Exception as e:
-                    print(f"Part {actual_index + 1} video creation failed: {str(e)}", file=sys.stderr)
-                    video_batch.append({
-                        "video": None,
-                        "duration": 0,
-                        "width": 0,
-                        "height": 0,
-                        "size": 0,
-                        "error": str(e)
-                    })
+                for i in batch_range:
+                    actual_index = i
+                    
+                    try:
+                        print(f"Creating video for part {actual_index + 1}/{len(audio_files)}...", file=sys.stderr)
+                        if executor:
+                            video_data = futures[actual_index].result()
+                        else:
+                            video_data = self.create_video(
+                                audio_files[actual_index],
+                                image_files[actual_index],
+                                translated_parts[actual_index],
+                                actual_index + 1
+                            )
+                        video_batch.append(video_data)
+                        print(f"Part {actual_index + 1} video created: {video_data['duration']:.1f}s, {video_data['size']} bytes", file=sys.stderr)
+                    except Exception as e:
+                        print(f"Part {actual_index + 1} video creation failed: {str(e)}", file=sys.stderr)
+                        video_batch.append({
+                            "video": None,
+                            "duration": 0,
+                            "width": 0,
+                            "height": 0,
+                            "size": 0,
+                            "error": str(e)
+                        })
+            finally:
+                if executor:
+                    executor.shutdown()
             
             # Determine if more batches remain
             has_more = end_idx < len(audio_files)
@@ -83,6 +217,8 @@ class handler(BaseHTTPRequestHandler):
             
         except json.JSONDecodeError as e:
             self.send_error_response(400, f"Invalid JSON: {str(e)}")
+        except MultipartError as e:
+            self.send_error_response(400, f"Invalid upload: {str(e)}")
         except Exception as e:
             self.send_error_response(500, f"Unexpected error: {str(e)}")
     
@@ -91,9 +227,9 @@ class handler(BaseHTTPRequestHandler):
         Create a 9:16 vertical video combining image, audio, and subtitles.
         Returns dict with base64 video data and metadata.
         """
-        # Decode base64 data
-        audio_bytes = base64.b64decode(audio_data["audio"])
-        image_bytes = base64.b64decode(image_data["image"])
+        # Decode base64 data (multipart uploads are already raw)
+        audio_bytes = _as_bytes(audio_data["audio"])
+        image_bytes = _as_bytes(image_data["image"])
         
         # Load image
         img = Image.open(io.BytesIO(image_bytes))
@@ -112,57 +248,43 @@ class handler(BaseHTTPRequestHandler):
         # Calculate number of frames needed
         num_frames = int(audio_duration * fps)
         
-        # Create video frames with subtitles
-        frames = []
-        for frame_num in range(num_frames):
-            # Create a copy of the image for this frame
-            frame_img = img.copy()
-            
-            # Add subtitle text overlay (appears in bottom third)
-            if subtitle_text:
-                frame_img = self.add_subtitle(frame_img, subtitle_text, frame_num, num_frames, part_number)
-            
-            # Convert PIL image to numpy array for imageio
-            import numpy as np
-            frame_array = np.array(frame_img)
-            frames.append(frame_array)
+        # Subtitles are static for the whole part, so render one frame and
+        # feed the encoder that same buffer for every frame. The fitted image
+        # is already a fresh resize result owned by this call, so it is drawn
+        # on directly rather than copied first
+        frame_img = img
+        
+        # Add subtitle text overlay (appears in bottom third)
+        if subtitle_text:
+            frame_img = self.add_subtitle(frame_img, subtitle_text, 0, num_frames, part_number)
         
-        # Create temporary files for video and audio
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as video_file:
-            video_path = video_file.name
+        if frame_img.mode != 'RGB':
+            frame_img = frame_img.convert('RGB')
         
+        # Raw RGB bytes for ffmpeg, taken straight from PIL in one copy
+        frame_bytes = frame_img.tobytes()
+        frame_size = (target_width, target_height)
+        
+        # Create temporary file for audio
         with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as audio_file:
             audio_file.write(audio_bytes)
             audio_path = audio_file.name
         
         try:
-            # Write video without audio first
-            imageio.mimwrite(video_path, frames, fps=fps, codec='libx264', quality=8)
+            # Encode video without audio, in a single pass capped to the size limit.
+            # ffmpeg writes fragmented MP4 to stdout so no output file is needed.
+            output_params = _size_capped_x264_params(audio_duration, _MAX_VIDEO_BYTES)
+            video_bytes = self.encode_still_video(frame_bytes, frame_size, num_frames, fps, output_params)
             
-            # Combine video with audio using imageio-ffmpeg
-            # Note: This requires FFmpeg, which may not be available on Vercel
-            # If FFmpeg is not available, we'll return video without audio
-            try:
-                from imageio_ffmpeg import write_frames
-                # For now, return video without audio if FFmpeg unavailable
-                # In production, you might want to use a different approach
-                final_video_path = video_path
-            except:
-                # FFmpeg not available, use video without audio
-                final_video_path = video_path
-                print("FFmpeg not available, creating video without audio", file=sys.stderr)
-            
-            # Read final video
-            with open(final_video_path, 'rb') as f:
-                video_bytes = f.read()
-            
-            # Optimize video size if too large
-            if len(video_bytes) > 3 * 1024 * 1024:  # 3MB limit
-                # Re-encode with lower quality
-                video_bytes = self.reencode_video(frames, fps, quality=6)
+            # Optimize video size if too large: re-encode at lower quality
+            # against half the budget
+            if len(video_bytes) > _MAX_VIDEO_BYTES:
+                print(f"Part {part_number} video is {len(video_bytes)} bytes, re-encoding at a lower bitrate", file=sys.stderr)
+                output_params = _size_capped_x264_params(audio_duration, _MAX_VIDEO_BYTES // 2, crf=30)
+                video_bytes = self.encode_still_video(frame_bytes, frame_size, num_frames, fps, output_params)
             
             # Convert to base64
-            video_base64 = base64.b64encode(video_bytes).decode('utf-8')
+            video_base64 = _b64encode(video_bytes)
             
             return {
                 "video": video_base64,
@@ -175,9 +297,8 @@ class handler(BaseHTTPRequestHandler):
             }
             
         finally:
-            # Clean up temporary files
+            # Clean up temporary file
             try:
-                os.unlink(video_path)
                 os.unlink(audio_path)
             except:
                 pass
@@ -199,42 +320,20 @@ class handler(BaseHTTPRequestHandler):
             top = (img_height - new_height) // 2
             img = img.crop((0, top, img_width, top + new_height))
         
-        # Resize to target dimensions
-        img = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
+        # Resize to target dimensions. For large downscales, reducing_gap lets
+        # Pillow box-reduce by an integer factor first and only run LANCZOS on
+        # an image at most ~2x the target size.
+        img = img.resize((target_width, target_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
         return img
     
     def add_subtitle(self, img, text, frame_num, total_frames, part_number):
         """Add subtitle text overlay to image"""
         draw = ImageDraw.Draw(img)
         
-        # Try to load a font, fallback to default if not available
-        try:
-            # Try to use a system font
-            font_size = 48
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-        except:
-            try:
-                font = ImageFont.load_default()
-            except:
-                font = None
+        font = _SUBTITLE_FONT
         
         # Split text into lines (max 40 chars per line, max 3 lines)
-        words = text.split()
-        lines = []
-        current_line = ""
-        
-        for word in words:
-            if len(current_line + word) < 40:
-                current_line += word + " "
-            else:
-                if current_line:
-                    lines.append(current_line.strip())
-                current_line = word + " "
-                if len(lines) >= 2:  # Max 3 lines
-                    break
-        
-        if current_line:
-            lines.append(current_line.strip())
+        lines = textwrap.wrap(text, width=40, max_lines=3, placeholder='...')
         
         # Calculate text position (bottom third of image)
         img_width, img_height = img.size
@@ -246,55 +345,55 @@ class handler(BaseHTTPRequestHandler):
         for i, line in enumerate(lines):
             y_pos = start_y + (i * line_height)
             
-            # Draw black outline (shadow)
-            for dx in [-2, -1, 0, 1, 2]:
-                for dy in [-2, -1, 0, 1, 2]:
-                    if dx != 0 or dy != 0:
-                        draw.text((img_width // 2 + dx, y_pos + dy), line, 
-                                 fill=(0, 0, 0), font=font, anchor="mm")
-            
-            # Draw white text
+            # Draw white text with a black outline in a single pass
             draw.text((img_width // 2, y_pos), line, 
-                     fill=(255, 255, 255), font=font, anchor="mm")
+                     fill=(255, 255, 255), font=font, anchor="mm",
+                     stroke_width=2, stroke_fill=(0, 0, 0))
         
         return img
     
-    def reencode_video(self, frames, fps, quality=6):
-        """Re-encode video with lower quality to reduce size"""
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        try:
-            imageio.mimwrite(temp_path, frames, fps=fps, codec='libx264', quality=quality)
-            with open(temp_path, 'rb') as f:
-                return f.read()
-        finally:
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+    def encode_still_video(self, frame_bytes, frame_size, num_frames, fps, output_params):
+        """
+        Encode a video that shows one raw RGB frame for num_frames frames.
+        Only the single frame is piped to ffmpeg; its loop filter repeats it.
+        Returns the MP4 bytes read from ffmpeg's stdout.
+        """
+        width, height = frame_size
+        cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-v', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+            '-r', str(fps), '-i', 'pipe:0',
+            '-vf', f'loop=loop={max(num_frames, 1) - 1}:size=1:start=0',
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+        ] + output_params + [
+            '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov', 'pipe:1'
+        ]
+        result = subprocess.run(cmd, input=frame_bytes, capture_output=True)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg encode failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
     
     def send_success_response(self, data):
-        """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        """Send successful JSON response, streaming large base64 fields"""
+        send_headers(self, 200, JSON_HEADERS)
+        
+        pending = bytearray()
+        for piece in _iter_json(data):
+            if len(piece) < _RESPONSE_WRITE_CHUNK:
+                pending += piece
+                continue
+            if pending:
+                self.wfile.write(pending)
+                pending.clear()
+            self.wfile.write(piece)
+        self.wfile.write(pending)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
+        send_headers(self, status_code, JSON_HEADERS)
         self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
+        send_headers(self, 200, PREFLIGHT_HEADERS)
 
@@ -1,14 +1,95 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import orjson
 import sys
+import os
+import logging
+import re
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
+from api._http import PREFLIGHT_HEADERS, read_body, send_headers, send_json
+
+# Words are runs of letters, keeping hyphenated and contracted forms
+# (e.g. "mag-isa") together; punctuation and digits are dropped
+_WORD_RE = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+
+# Common words to leave out of key phrases
+_COMMON_WORDS = frozenset({
+    'ang', 'ng', 'sa', 'na', 'ay', 'at', 'o', 'si', 'ni', 'kay', 'para', 'nga', 'din', 'rin',
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did'
+})
+
+# Tags every part gets, ahead of its part and key phrase tags
+_BASE_TAGS = (
+    "kwentong takot",
+    "true crime",
+    "horror story",
+    "tagalog horror",
+    "pinoy horror",
+    "filipino horror",
+    "scary story",
+    "true story",
+    "mystery",
+    "suspense"
+)
+
+# Tags the full-length compilation always gets
+_FULL_BASE_TAGS = (
+    "kwentong takot",
+    "true crime",
+    "horror story",
+    "tagalog horror",
+    "pinoy horror",
+    "filipino horror",
+    "buong kwento",
+    "full story",
+    "complete story",
+    "scary story",
+    "true story",
+    "mystery",
+    "suspense",
+    "compilation"
+)
+
+# Closing lines shared by every description
+_ENGAGEMENT_HOOKS = (
+    "🔔 Mag-subscribe para sa mas maraming kwentong takot!\n"
+    "👍 I-like kung nagustuhan mo ang kwento!\n"
+    "💬 Mag-comment ng iyong mga karanasan!"
+)
+_STANDARD_HASHTAGS = "#KwentongTakot #TrueCrime #HorrorStory #TagalogHorror #PinoyHorror"
+
+@lru_cache(maxsize=256)
+def _count_key_words(text):
+    """
+    Count the non-common words of a text. Cached, so the full-video
+    metadata can merge the counts of parts that were already tokenized.
+    The returned Counter is shared and must not be modified.
+    """
+    words = _WORD_RE.findall(text.lower())
+    # Filter out common words and short words
+    return Counter(w for w in words if len(w) > 4 and w not in _COMMON_WORDS)
+
+# Per-part progress is logged at DEBUG and skipped (unformatted) unless
+# LOG_LEVEL asks for it; warnings still reach Vercel's logs via stderr
+_log = logging.getLogger(__name__)
+_log_level = os.environ.get("LOG_LEVEL", "WARNING").upper()
+# An unknown level name falls back to WARNING instead of failing the import
+_log.setLevel(_log_level if isinstance(logging.getLevelName(_log_level), int) else logging.WARNING)
+if not _log.handlers:
+    _log.addHandler(logging.StreamHandler(sys.stderr))
+    _log.propagate = False
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            # orjson parses the bytearray directly, without a str copy
+            body = read_body(self.rfile, content_length)
+            data = orjson.loads(body)
             
             # Validate input
             if "translated_parts" not in data:
@@ -25,7 +106,7 @@ class handler(BaseHTTPRequestHandler):
                 self.send_error_response(400, "translated_parts array cannot be empty")
                 return
             
-            print(f"Generating metadata for {len(translated_parts)} parts", file=sys.stderr)
+            _log.info("Generating metadata for %d parts", len(translated_parts))
             
             # Generate metadata for all parts
             metadata_list = []
@@ -33,11 +114,11 @@ class handler(BaseHTTPRequestHandler):
             for i, part_text in enumerate(translated_parts):
                 part_number = i + 1
                 try:
-                    print(f"Generating metadata for part {part_number}/{len(translated_parts)}...", file=sys.stderr)
+                    _log.debug("Generating metadata for part %d/%d...", part_number, len(translated_parts))
                     metadata = self.generate_part_metadata(part_text, part_number, len(translated_parts))
                     metadata_list.append(metadata)
                 except Exception as e:
-                    print(f"Part {part_number} metadata generation failed: {str(e)}", file=sys.stderr)
+                    _log.warning("Part %d metadata generation failed: %s", part_number, e)
                     # Create default metadata on error
                     metadata_list.append(self.create_default_metadata(part_number, len(translated_parts)))
             
@@ -61,15 +142,17 @@ class handler(BaseHTTPRequestHandler):
         """
         Generate title, description, and tags for a single video part.
         """
+        # Split into sentences once; title and description both use them
+        sentences = [s.strip() for s in text.split('.') if s.strip()]
+        
         # Extract key phrases from text
-        sentences = text.split('.')[:3]  # First 3 sentences
         key_phrases = self.extract_key_phrases(text)
         
         # Generate title
-        title = self.generate_title(text, part_number, total_parts, key_phrases)
+        title = self.generate_title(sentences, part_number, total_parts, key_phrases)
         
         # Generate description
-        description = self.generate_description(text, part_number, total_parts, key_phrases)
+        description = self.generate_description(sentences, part_number, total_parts, key_phrases)
         
         # Generate tags
         tags = self.generate_tags(key_phrases, part_number, total_parts)
@@ -84,26 +167,13 @@ class handler(BaseHTTPRequestHandler):
     
     def extract_key_phrases(self, text):
         """Extract important words/phrases from text"""
-        # Simple keyword extraction (remove common words)
-        common_words = {'ang', 'ng', 'sa', 'na', 'ay', 'at', 'o', 'si', 'ni', 'kay', 'para', 'nga', 'din', 'rin', 
-                       'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
-                       'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did'}
-        
-        words = text.lower().split()
-        # Filter out common words and short words
-        key_words = [w for w in words if len(w) > 4 and w not in common_words]
-        
-        # Count frequency
-        from collections import Counter
-        word_freq = Counter(key_words)
-        
         # Return top keywords
-        return [word for word, count in word_freq.most_common(10)]
+        return [word for word, count in _count_key_words(text).most_common(10)]
     
-    def generate_title(self, text, part_number, total_parts, key_phrases):
+    def generate_title(self, sentences, part_number, total_parts, key_phrases):
         """Generate engaging title for video part"""
         # Extract first sentence or key phrase
-        first_sentence = text.split('.')[0].strip()
+        first_sentence = sentences[0] if sentences else ""
         
         # Create title with part number
         if total_parts > 1:
@@ -133,7 +203,7 @@ class handler(BaseHTTPRequestHandler):
         
         return title
     
-    def generate_description(self, text, part_number, total_parts, key_phrases):
+    def generate_description(self, sentences, part_number, total_parts, key_phrases):
         """Generate description for video part"""
         # Start with part info
         if total_parts > 1:
@@ -142,16 +212,13 @@ class handler(BaseHTTPRequestHandler):
             description = ""
         
         # Add first 2-3 sentences of the story
-        sentences = [s.strip() for s in text.split('.') if s.strip()][:3]
+        sentences = sentences[:3]
         description += '. '.join(sentences)
         if len(sentences) > 0:
             description += "."
         
         # Add engagement hooks
-        description += "\n\n"
-        description += "🔔 Mag-subscribe para sa mas maraming kwentong takot!\n"
-        description += "👍 I-like kung nagustuhan mo ang kwento!\n"
-        description += "💬 Mag-comment ng iyong mga karanasan!"
+        description += "\n\n" + _ENGAGEMENT_HOOKS
         
         # Add hashtags from key phrases
         if key_phrases:
@@ -160,48 +227,33 @@ class handler(BaseHTTPRequestHandler):
             description += " ".join(hashtags)
         
         # Add standard tags
-        description += " #KwentongTakot #TrueCrime #HorrorStory #TagalogHorror #PinoyHorror"
+        description += " " + _STANDARD_HASHTAGS
         
         return description
     
     def generate_tags(self, key_phrases, part_number, total_parts):
         """Generate tags for video part"""
-        # Base tags (always include)
-        tags = [
-            "kwentong takot",
-            "true crime",
-            "horror story",
-            "tagalog horror",
-            "pinoy horror",
-            "filipino horror",
-            "scary story",
-            "true story",
-            "mystery",
-            "suspense"
-        ]
-        
         # Add part-specific tags
         if total_parts > 1:
-            tags.append(f"bahagi {part_number}")
-            tags.append("serye")
+            part_tags = (f"bahagi {part_number}", "serye")
+        else:
+            part_tags = ()
         
         # Add key phrase tags (if they're good keywords)
-        for phrase in key_phrases[:5]:
-            if len(phrase) > 3 and len(phrase) < 20:
-                tags.append(phrase.lower())
+        phrase_tags = (phrase.lower() for phrase in key_phrases[:5] if 3 < len(phrase) < 20)
         
         # Remove duplicates and limit to 20 tags
-        unique_tags = list(dict.fromkeys(tags))[:20]
-        
-        return unique_tags
+        return list(dict.fromkeys(chain(_BASE_TAGS, part_tags, phrase_tags)))[:20]
     
     def generate_full_metadata(self, translated_parts):
         """Generate metadata for the full long-form video"""
-        # Combine all parts
-        full_text = " ".join(translated_parts)
-        
-        # Extract key phrases from full text
-        key_phrases = self.extract_key_phrases(full_text)
+        # Merge the cached per-part word counts instead of tokenizing the
+        # combined text again (parts are joined by spaces, so the counts
+        # are the same)
+        word_freq = Counter()
+        for part in translated_parts:
+            word_freq.update(_count_key_words(part))
+        key_phrases = [word for word, count in word_freq.most_common(10)]
         
         # Generate title
         first_part = translated_parts[0] if translated_parts else ""
@@ -231,37 +283,14 @@ class handler(BaseHTTPRequestHandler):
         if len(translated_parts) > 10:
             description += f"... at {len(translated_parts) - 10} pang bahagi\n"
         
-        description += "\n"
-        description += "🔔 Mag-subscribe para sa mas maraming kwentong takot!\n"
-        description += "👍 I-like kung nagustuhan mo ang kwento!\n"
-        description += "💬 Mag-comment ng iyong mga karanasan!\n\n"
-        description += "#KwentongTakot #TrueCrime #HorrorStory #TagalogHorror #PinoyHorror #BuongKwento"
-        
-        # Generate tags
-        tags = [
-            "kwentong takot",
-            "true crime",
-            "horror story",
-            "tagalog horror",
-            "pinoy horror",
-            "filipino horror",
-            "buong kwento",
-            "full story",
-            "complete story",
-            "scary story",
-            "true story",
-            "mystery",
-            "suspense",
-            "compilation"
-        ]
+        description += "\n" + _ENGAGEMENT_HOOKS + "\n\n"
+        description += _STANDARD_HASHTAGS + " #BuongKwento"
         
-        # Add key phrase tags
-        for phrase in key_phrases[:10]:
-            if len(phrase) > 3 and len(phrase) < 20:
-                tags.append(phrase.lower())
+        # Generate tags, adding key phrase tags after the base ones
+        phrase_tags = (phrase.lower() for phrase in key_phrases[:10] if 3 < len(phrase) < 20)
         
         # Remove duplicates and limit
-        unique_tags = list(dict.fromkeys(tags))[:25]
+        unique_tags = list(dict.fromkeys(chain(_FULL_BASE_TAGS, phrase_tags)))[:25]
         
         return {
             "title": title,
@@ -282,25 +311,16 @@ class handler(BaseHTTPRequestHandler):
     
     def send_success_response(self, data):
         """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        # orjson serializes straight to bytes, so there's no str to encode
+        payload = orjson.dumps(data)
+        send_json(self, 200, payload)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
+        payload = orjson.dumps({"error": error_message})
+        send_json(self, status_code, payload)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
+        send_headers(self, 200, PREFLIGHT_HEADERS)
 
@@ -1,18 +1,148 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import base64
+import orjson
+import pybase64
 import io
+import os
 import sys
+import hashlib
+import tempfile
 import requests
+import urllib.parse
+from urllib3.util.retry import Retry
 from PIL import Image, ImageDraw, ImageFont
+from api._http import PREFLIGHT_HEADERS, read_body, send_headers, send_json
+
+# Shared session so warm invocations reuse TLS connections; transient
+# gateway errors are retried with backoff, while the final error response
+# is still returned to the caller's own status handling
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(
+    pool_maxsize=4,
+    max_retries=Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False
+    )
+))
+
+def _load_title_font():
+    """Load a bold title font, falling back to the default if not available"""
+    font_size = 72
+    try:
+        # Try system fonts (varies by system)
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
+    except:
+        try:
+            return ImageFont.truetype("arial.ttf", font_size)
+        except:
+            # Fallback to default font (smaller)
+            try:
+                return ImageFont.load_default()
+            except:
+                return None
+
+# Parsed once per process rather than on every thumbnail
+_TITLE_FONT = _load_title_font()
+
+# Base images keyed by prompt. Episodes in the same style usually produce the
+# same prompt, and only the title overlay differs between them, so the
+# un-annotated image is kept on local disk across warm invocations
+_BASE_IMAGE_CACHE = os.path.join(tempfile.gettempdir(), "thumbnail_base_cache")
+# /tmp is shared with everything else in the function (512 MB on Vercel), so
+# the least recently used images are evicted beyond this many bytes
+_BASE_IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def _base_image_path(prompt):
+    """Cache file for the base image generated from a prompt"""
+    normalized = " ".join(prompt.lower().split())
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(_BASE_IMAGE_CACHE, f"{digest}.img")
+
+def _read_cached_base_image(path):
+    """Return cached image bytes, or None on a miss"""
+    try:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        # Bump the mtime so eviction drops the least recently used images
+        os.utime(path)
+        return image_bytes
+    except OSError:
+        return None
+
+def _discard_cached_base_image(path):
+    """Remove a cache entry that turned out not to be a usable image"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def _evict_base_images():
+    """Delete the least recently used cached images until under the byte cap"""
+    try:
+        entries = []
+        with os.scandir(_BASE_IMAGE_CACHE) as it:
+            for entry in it:
+                if entry.name.endswith(".img"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= _BASE_IMAGE_CACHE_MAX_BYTES:
+            break
+        _discard_cached_base_image(path)
+        total -= size
+
+def _write_cached_base_image(path, image_bytes):
+    """Store image bytes; a failed write only costs a future cache miss"""
+    try:
+        os.makedirs(_BASE_IMAGE_CACHE, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache base image: {str(e)}", file=sys.stderr)
+        return
+    _evict_base_images()
+
+def _decode_base_image(image_bytes):
+    """
+    Decode a base image, or return None if the bytes aren't a valid image.
+    Pollinations normally returns exactly the requested 1280x720 image, so
+    the JPEG decoder is only asked to downscale when it didn't.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.size != (1280, 720):
+            img.draft('RGB', (1280, 720))
+        img.load()
+        return img
+    except Exception as e:
+        print(f"Base image could not be decoded: {str(e)}", file=sys.stderr)
+        return None
+
+# Scene prompt per thumbnail style, plus the modifiers appended to every one
+_SCENE_PROMPTS = {
+    "horror": "dark atmospheric horror scene, mysterious, suspenseful",
+    "true_crime": "true crime scene, dramatic, investigative, mysterious",
+}
+_DEFAULT_SCENE_PROMPT = "dramatic scene, cinematic"
+_STYLE_MODIFIERS = "high quality, detailed, 4k, professional photography, YouTube thumbnail style, eye-catching, bold colors, high contrast"
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            # orjson parses the bytearray directly, without a str copy
+            body = read_body(self.rfile, content_length)
+            data = orjson.loads(body)
             
             # Validate input
             if "title" not in data:
@@ -56,8 +186,53 @@ class handler(BaseHTTPRequestHandler):
         # Generate base image using Pollinations.ai (free, no API key)
         prompt = self.create_thumbnail_prompt(title, description, style)
         
+        cache_path = _base_image_path(prompt)
+        image_bytes = _read_cached_base_image(cache_path)
+        img = _decode_base_image(image_bytes) if image_bytes is not None else None
+        if img is not None:
+            print(f"Using cached base image for prompt: {prompt[:100]}...", file=sys.stderr)
+        else:
+            if image_bytes is not None:
+                _discard_cached_base_image(cache_path)
+            image_bytes = self.fetch_base_image(prompt)
+            img = _decode_base_image(image_bytes)
+            if img is None:
+                raise Exception("Pollinations.ai returned data that is not a valid image")
+            # Only cache bytes that decoded, so a bad response can't stick
+            _write_cached_base_image(cache_path, image_bytes)
+        
+        # Only convert and resample when the image isn't already 1280x720 RGB
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != (1280, 720):
+            img = img.resize((1280, 720), Image.Resampling.LANCZOS)
+        
+        # Add text overlay
+        img = self.add_text_overlay(img, title)
+        
+        # Encode image. Pillow's encoder is already libjpeg-turbo; the extra
+        # Huffman optimization pass (optimize=True) is skipped as it costs
+        # several times the encode for a few percent smaller files
+        output_buffer = io.BytesIO()
+        img.save(output_buffer, format='JPEG', quality=90)
+        
+        # Convert to base64, reading the buffer in place rather than
+        # copying it out with getvalue() first
+        with output_buffer.getbuffer() as thumbnail_view:
+            thumbnail_base64 = pybase64.b64encode_as_string(thumbnail_view)
+            thumbnail_size = thumbnail_view.nbytes
+        
+        return {
+            "thumbnail": thumbnail_base64,
+            "width": 1280,
+            "height": 720,
+            "size": thumbnail_size,
+            "format": "jpeg"
+        }
+    
+    def fetch_base_image(self, prompt):
+        """Request the base image for a prompt from Pollinations.ai"""
         # Use Pollinations.ai - completely free, no API key needed
-        import urllib.parse
         encoded_prompt = urllib.parse.quote(prompt)
         
         # Pollinations.ai API endpoint (16:9 for YouTube thumbnail)
@@ -67,11 +242,11 @@ class handler(BaseHTTPRequestHandler):
         
         # Make request with timeout
         try:
-            response = requests.get(api_url, timeout=30, stream=True)
+            response = _SESSION.get(api_url, timeout=30, stream=True)
         except requests.exceptions.Timeout:
             # Retry once with longer timeout
             print("Request timed out, retrying...", file=sys.stderr)
-            response = requests.get(api_url, timeout=45, stream=True)
+            response = _SESSION.get(api_url, timeout=45, stream=True)
         
         if response.status_code != 200:
             error_msg = f"API returned status {response.status_code}"
@@ -87,50 +262,23 @@ class handler(BaseHTTPRequestHandler):
             raise Exception(f"Pollinations.ai API error: {error_msg}")
         
         # Get image bytes (Pollinations returns image directly)
-        image_bytes = response.content
-        
-        # Load and process image
-        img = Image.open(io.BytesIO(image_bytes))
-        img = img.convert('RGB')
-        img = img.resize((1280, 720), Image.Resampling.LANCZOS)
-        
-        # Add text overlay
-        img = self.add_text_overlay(img, title)
-        
-        # Optimize image
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, format='JPEG', quality=90, optimize=True)
-        thumbnail_bytes = output_buffer.getvalue()
-        
-        # Convert to base64
-        thumbnail_base64 = base64.b64encode(thumbnail_bytes).decode('utf-8')
-        
-        return {
-            "thumbnail": thumbnail_base64,
-            "width": 1280,
-            "height": 720,
-            "size": len(thumbnail_bytes),
-            "format": "jpeg"
-        }
+        return response.content
     
     def create_thumbnail_prompt(self, title, description, style):
         """Create prompt for thumbnail image generation"""
         # Extract key words from title
-        words = title.lower().split()
-        key_words = [w for w in words if len(w) > 3][:5]
-        
-        # Style-specific prompts
-        if style == "horror" or "horror" in title.lower():
-            base_prompt = f"dark atmospheric horror scene, mysterious, suspenseful, {', '.join(key_words[:3])}"
-        elif style == "true_crime" or "crime" in title.lower():
-            base_prompt = f"true crime scene, dramatic, investigative, mysterious, {', '.join(key_words[:3])}"
-        else:
-            base_prompt = f"dramatic scene, cinematic, {', '.join(key_words[:3])}"
+        title_lower = title.lower()
+        key_words = [w for w in title_lower.split() if len(w) > 3][:3]
         
-        # Add style modifiers
-        style_modifiers = "high quality, detailed, 4k, professional photography, YouTube thumbnail style, eye-catching, bold colors, high contrast"
+        # Style-specific prompts; a genre word in the title also selects
+        # its scene, with horror taking precedence over true crime
+        if "horror" in title_lower:
+            style = "horror"
+        elif "crime" in title_lower and style != "horror":
+            style = "true_crime"
+        scene = _SCENE_PROMPTS.get(style, _DEFAULT_SCENE_PROMPT)
         
-        prompt = f"{base_prompt}, {style_modifiers}"
+        prompt = f"{scene}, {', '.join(key_words)}, {_STYLE_MODIFIERS}"
         
         # Limit prompt length
         if len(prompt) > 200:
@@ -142,21 +290,7 @@ class handler(BaseHTTPRequestHandler):
         """Add title text overlay to thumbnail"""
         draw = ImageDraw.Draw(img)
         
-        # Try to load a bold font
-        font_size = 72
-        try:
-            # Try system fonts (varies by system)
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-        except:
-            try:
-                font = ImageFont.truetype("arial.ttf", font_size)
-            except:
-                # Fallback to default font (smaller)
-                try:
-                    font = ImageFont.load_default()
-                    font_size = 20
-                except:
-                    font = None
+        font = _TITLE_FONT
         
         # Split title into lines (max 40 chars per line, max 2 lines)
         words = title.split()
@@ -178,6 +312,7 @@ class handler(BaseHTTPRequestHandler):
         
         # Calculate text position (center, slightly above middle)
         img_width, img_height = img.size
+        center_x = img_width // 2
         text_y = int(img_height * 0.4)  # 40% down
         line_height = 90
         
@@ -185,40 +320,26 @@ class handler(BaseHTTPRequestHandler):
         for i, line in enumerate(lines):
             y_pos = text_y + (i * line_height)
             
-            # Draw black outline (shadow) for better visibility
-            for dx in [-3, -2, -1, 0, 1, 2, 3]:
-                for dy in [-3, -2, -1, 0, 1, 2, 3]:
-                    if dx != 0 or dy != 0:
-                        draw.text((img_width // 2 + dx, y_pos + dy), line, 
-                                 fill=(0, 0, 0), font=font, anchor="mm", stroke_width=2)
-            
-            # Draw white text
-            draw.text((img_width // 2, y_pos), line, 
-                     fill=(255, 255, 255), font=font, anchor="mm", stroke_width=1)
+            # Draw white text with a black outline for better visibility; the
+            # 5px stroke matches the reach of the old offset-shadow passes
+            draw.text((center_x, y_pos), line, 
+                     fill=(255, 255, 255), font=font, anchor="mm",
+                     stroke_width=5, stroke_fill=(0, 0, 0))
         
         return img
     
     def send_success_response(self, data):
         """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        # orjson serializes straight to bytes, so there's no str to encode
+        payload = orjson.dumps(data)
+        send_json(self, 200, payload)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
+        payload = orjson.dumps({"error": error_message})
+        send_json(self, status_code, payload)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
+        send_headers(self, 200, PREFLIGHT_HEADERS)
 
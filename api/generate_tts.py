@@ -1,17 +1,91 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import base64
+import orjson
+import pybase64
 import io
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+from gtts import gTTS
+from api._http import PREFLIGHT_HEADERS, read_body, send_headers, send_json
+
+# MPEG audio frame header tables, used to measure MP3 duration without
+# decoding. Bitrates (kbps) are keyed by (is MPEG-1, layer), where layer
+# is the header's layer field: 3 = Layer I, 2 = Layer II, 1 = Layer III.
+_MP3_BITRATES = {
+    (True, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates keyed by the header's version field: 3 = MPEG-1,
+# 2 = MPEG-2, 0 = MPEG-2.5
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _mp3_duration(data):
+    """
+    Measure an MP3's duration in seconds by walking its frame headers.
+    Exact for both CBR and VBR streams, without decoding any audio.
+    Returns None if no frames are found.
+    """
+    pos = 0
+    size = len(data)
+    duration = 0.0
+    frames = 0
+    
+    while pos + 4 <= size:
+        # Skip ID3v2 tags (gTTS output can carry one per request chunk)
+        if data[pos:pos + 3] == b'ID3' and pos + 10 <= size:
+            tag_size = (data[pos + 6] << 21) | (data[pos + 7] << 14) | (data[pos + 8] << 7) | data[pos + 9]
+            pos += 10 + tag_size + (10 if data[pos + 5] & 0x10 else 0)
+            continue
+        
+        b1, b2 = data[pos + 1], data[pos + 2]
+        version = (b1 >> 3) & 3
+        layer = (b1 >> 1) & 3
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 3
+        if (data[pos] != 0xFF or (b1 & 0xE0) != 0xE0 or version == 1 or layer == 0
+                or bitrate_index in (0, 15) or rate_index == 3):
+            # Not a frame header; resync on the next possible sync byte
+            next_sync = data.find(b'\xff', pos + 1)
+            if next_sync < 0:
+                break
+            pos = next_sync
+            continue
+        
+        mpeg1 = version == 3
+        bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 1
+        if layer == 3:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if (layer == 2 or mpeg1) else 576
+            frame_length = samples // 8 * bitrate // sample_rate + padding
+        
+        # A leading Xing/Info frame only carries VBR metadata, not audio
+        if not (frames == 0 and (b'Xing' in data[pos + 4:pos + 40] or b'Info' in data[pos + 4:pos + 40])):
+            duration += samples / sample_rate
+        frames += 1
+        pos += frame_length
+    
+    return duration if frames else None
+
+# Upper bound on concurrent TTS requests per batch
+_TTS_WORKERS = 8
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            # orjson parses the bytearray directly, without a str copy
+            body = read_body(self.rfile, content_length)
+            data = orjson.loads(body)
             
             # Validate input
             if "parts" not in data:
@@ -41,34 +115,42 @@ class handler(BaseHTTPRequestHandler):
             
             print(f"Generating audio for batch {batch_index + 1}: parts {start_idx + 1} to {end_idx} of {len(parts)}", file=sys.stderr)
             
-            # Generate audio for batch
+            # Generate audio for batch. Each part is a blocking round trip to
+            # Google's TTS service, so the whole batch is requested
+            # concurrently and the results are collected in part order.
             audio_batch = []
             
-            for i, part in enumerate(batch_parts):
-                actual_index = start_idx + i
-                
-                if not part or not part.strip():
-                    audio_batch.append({
-                        "audio": None,
-                        "duration": 0,
-                        "size": 0,
-                        "error": "Empty text"
-                    })
-                    continue
+            with ThreadPoolExecutor(max_workers=_TTS_WORKERS) as executor:
+                futures = {}
+                for i, part in enumerate(batch_parts):
+                    if part and not part.isspace():
+                        print(f"Generating audio for part {start_idx + i + 1}/{len(parts)}...", file=sys.stderr)
+                        futures[i] = executor.submit(self.generate_audio, part, voice_lang, voice_speed)
                 
-                try:
-                    print(f"Generating audio for part {actual_index + 1}/{len(parts)}...", file=sys.stderr)
-                    audio_data = self.generate_audio(part, voice_lang, voice_speed)
-                    audio_batch.append(audio_data)
-                    print(f"Part {actual_index + 1} audio generated: {audio_data['duration']:.1f}s, {audio_data['size']} bytes", file=sys.stderr)
-                except Exception as e:
-                    print(f"Part {actual_index + 1} audio generation failed: {str(e)}", file=sys.stderr)
-                    audio_batch.append({
-                        "audio": None,
-                        "duration": 0,
-                        "size": 0,
-                        "error": str(e)
-                    })
+                for i, part in enumerate(batch_parts):
+                    actual_index = start_idx + i
+                    
+                    if i not in futures:
+                        audio_batch.append({
+                            "audio": None,
+                            "duration": 0,
+                            "size": 0,
+                            "error": "Empty text"
+                        })
+                        continue
+                    
+                    try:
+                        audio_data = futures[i].result()
+                        audio_batch.append(audio_data)
+                        print(f"Part {actual_index + 1} audio generated: {audio_data['duration']:.1f}s, {audio_data['size']} bytes", file=sys.stderr)
+                    except Exception as e:
+                        print(f"Part {actual_index + 1} audio generation failed: {str(e)}", file=sys.stderr)
+                        audio_batch.append({
+                            "audio": None,
+                            "duration": 0,
+                            "size": 0,
+                            "error": str(e)
+                        })
             
             # Determine if more batches remain
             has_more = end_idx < len(parts)
@@ -100,9 +182,6 @@ class handler(BaseHTTPRequestHandler):
             slow: If True, speaks slower
         Returns dict with base64 audio data and metadata.
         """
-        from gtts import gTTS
-        from pydub import AudioSegment
-        
         # Validate language code
         valid_langs = {
             'tl': 'Tagalog (Filipino)',
@@ -133,11 +212,9 @@ class handler(BaseHTTPRequestHandler):
         # Get audio data
         audio_bytes = audio_buffer.getvalue()
         
-        # Calculate duration using pydub
-        try:
-            audio_segment = AudioSegment.from_mp3(io.BytesIO(audio_bytes))
-            duration_seconds = len(audio_segment) / 1000.0  # pydub uses milliseconds
-        except Exception as e:
+        # Calculate duration from the MP3 frame headers
+        duration_seconds = _mp3_duration(audio_bytes)
+        if duration_seconds is None:
             # Fallback: estimate duration based on text length
             # Average speaking rate: ~150 words per minute
             word_count = len(text.split())
@@ -145,7 +222,7 @@ class handler(BaseHTTPRequestHandler):
             print(f"Could not get exact duration, estimated: {duration_seconds:.1f}s", file=sys.stderr)
         
         # Convert to base64 for JSON transmission
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+        audio_base64 = pybase64.b64encode_as_string(audio_bytes)
         
         return {
             "audio": audio_base64,  # Base64 encoded MP3
@@ -156,24 +233,15 @@ class handler(BaseHTTPRequestHandler):
     
     def send_success_response(self, data):
         """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        # orjson serializes straight to bytes, so there's no str to encode
+        payload = orjson.dumps(data)
+        send_json(self, 200, payload)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
+        payload = orjson.dumps({"error": error_message})
+        send_json(self, status_code, payload)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
\ No newline at end of file
+        send_headers(self, 200, PREFLIGHT_HEADERS)
\ No newline at end of file
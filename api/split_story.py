@@ -1,14 +1,50 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import orjson
 import re
+from api._http import PREFLIGHT_HEADERS, read_body, send_headers, send_json
+
+# Timestamps: "0 (59s):" / "1 (2m 32s):" markers, then "[00:15:42]" and
+# "(1:23)" style clock times. Each form is its own pass, in this order,
+# since removing one can join the text around it into another
+_TIMESTAMP_PATTERNS = [
+    re.compile(r'\d+\s*\(\d+[smh]+\s*\d*[smh]*\):'),
+    re.compile(r'\[?\d{1,2}:\d{2}:\d{2}\]?'),
+    re.compile(r'\[?\d{1,2}:\d{2}\]?'),
+]
+
+# Speaker labels (Host:, Guest:, Narrator:, etc.). Stripped in their own
+# pass before the phrases below, so a label splitting a phrase doesn't hide it
+_SPEAKER_LABEL_RE = re.compile(r'\b(?:Host|Guest|Narrator|Speaker \d+):\s*', re.IGNORECASE)
+
+# Common intro/outro phrases (can expand this list), also one pass each
+_REMOVAL_PHRASES = [
+    re.compile(phrase, re.IGNORECASE) for phrase in (
+        r'welcome to [^.!?]+[.!?]',
+        r'don\'t forget to subscribe[^.!?]*[.!?]',
+        r'this episode is brought to you by[^.!?]*[.!?]',
+        r'thanks to our sponsor[^.!?]*[.!?]',
+        r'before we begin[^.!?]*[.!?]',
+        r'let\'s get into it[.!?]',
+    )
+]
+
+# Music/sound effect markers
+_MARKER_RE = re.compile(r'\[MUSIC\]|\[SOUND EFFECT\]|\[SFX\]|\[AUDIO\]', re.IGNORECASE)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Sentence-ending punctuation (handles common punctuation)
+_SENTENCE_END = ('.', '!', '?')
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            # orjson parses the bytearray directly, without a str copy
+            body = read_body(self.rfile, content_length)
+            data = orjson.loads(body)
             
             # Validate input
             if "text" not in data:
@@ -24,7 +60,7 @@ class handler(BaseHTTPRequestHandler):
             
             # Clean and split the text
             cleaned_text = self.clean_transcript(raw_text)
-            story_parts = self.split_into_parts(cleaned_text, target_words)
+            story_parts, part_word_counts = self.split_into_parts(cleaned_text, target_words)
             
             # Validate we got parts
             if not story_parts:
@@ -32,7 +68,7 @@ class handler(BaseHTTPRequestHandler):
                 return
             
             # Calculate statistics
-            total_words = sum(len(part.split()) for part in story_parts)
+            total_words = sum(part_word_counts)
             
             response_data = {
                 "parts": story_parts,
@@ -54,34 +90,17 @@ class handler(BaseHTTPRequestHandler):
         Remove timestamps, speaker labels, and other non-story content.
         Keep only the pure story text.
         """
-        # Remove timestamp patterns like "0 (59s):", "0 (1m 43s):", "1 (2m 32s):"
-        text = re.sub(r'\d+\s*\(\d+[smh]+\s*\d*[smh]*\):', '', text)
-        
-        # Remove standalone timestamps like "[00:15]", "(1:23)", etc.
-        text = re.sub(r'\[?\d{1,2}:\d{2}:\d{2}\]?', '', text)
-        text = re.sub(r'\[?\d{1,2}:\d{2}\]?', '', text)
-        
-        # Remove common speaker labels (Host:, Guest:, Narrator:, etc.)
-        text = re.sub(r'\b(Host|Guest|Narrator|Speaker \d+):\s*', '', text, flags=re.IGNORECASE)
-        
-        # Remove common intro/outro phrases (can expand this list)
-        removal_phrases = [
-            r'welcome to [^.!?]+[.!?]',
-            r'don\'t forget to subscribe[^.!?]*[.!?]',
-            r'this episode is brought to you by[^.!?]*[.!?]',
-            r'thanks to our sponsor[^.!?]*[.!?]',
-            r'before we begin[^.!?]*[.!?]',
-            r'let\'s get into it[.!?]',
-        ]
-        
-        for phrase in removal_phrases:
-            text = re.sub(phrase, '', text, flags=re.IGNORECASE)
-        
-        # Remove music/sound effect markers
-        text = re.sub(r'\[MUSIC\]|\[SOUND EFFECT\]|\[SFX\]|\[AUDIO\]', '', text, flags=re.IGNORECASE)
+        # Remove timestamps, speaker labels, intro/outro phrases and
+        # music/sound effect markers, in that order
+        for pattern in _TIMESTAMP_PATTERNS:
+            text = pattern.sub('', text)
+        text = _SPEAKER_LABEL_RE.sub('', text)
+        for phrase in _REMOVAL_PHRASES:
+            text = phrase.sub('', text)
+        text = _MARKER_RE.sub('', text)
         
         # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = _WHITESPACE_RE.sub(' ', text)
         
         # Remove leading/trailing whitespace
         text = text.strip()
@@ -92,73 +111,64 @@ class handler(BaseHTTPRequestHandler):
         """
         Split text into parts of approximately target_words each.
         Ensures parts end at sentence boundaries for natural flow.
+        Returns (parts, word_counts).
         """
-        # Split into sentences (handles common punctuation)
-        sentences = re.split(r'(?<=[.!?])\s+', text)
+        # Tokenize once; a word ending in . ! or ? closes a sentence, and
+        # parts are slices of the word list between sentence boundaries
+        words = text.split()
+        last = len(words) - 1
         
         parts = []
-        current_part = []
-        current_word_count = 0
+        word_counts = []
+        part_start = 0
+        sentence_start = 0
         
         # Min and max word bounds (allow some flexibility)
         min_words = int(target_words * 0.8)  # 80% of target (280 words for 350 target)
         max_words = int(target_words * 1.2)  # 120% of target (420 words for 350 target)
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
+        for i, word in enumerate(words):
+            if i != last and not word.endswith(_SENTENCE_END):
                 continue
             
-            sentence_words = len(sentence.split())
+            sentence_end = i + 1
+            sentence_words = sentence_end - sentence_start
+            current_word_count = sentence_start - part_start
             
             # If adding this sentence would exceed max, start a new part
             if current_word_count > 0 and (current_word_count + sentence_words) > max_words:
-                # Only create part if it meets minimum word count
+                # Only create part if it meets minimum word count; otherwise
+                # it's still too short and the sentence is added anyway
                 if current_word_count >= min_words:
-                    parts.append(' '.join(current_part))
-                    current_part = [sentence]
-                    current_word_count = sentence_words
-                else:
-                    # Still too short, add the sentence anyway
-                    current_part.append(sentence)
-                    current_word_count += sentence_words
-            else:
-                # Add sentence to current part
-                current_part.append(sentence)
-                current_word_count += sentence_words
-                
-                # If we've reached target and have good stopping point, finalize part
-                if current_word_count >= target_words:
-                    parts.append(' '.join(current_part))
-                    current_part = []
-                    current_word_count = 0
+                    parts.append(' '.join(words[part_start:sentence_start]))
+                    word_counts.append(current_word_count)
+                    part_start = sentence_start
+            elif sentence_end - part_start >= target_words:
+                # Reached target at a good stopping point, finalize part
+                parts.append(' '.join(words[part_start:sentence_end]))
+                word_counts.append(sentence_end - part_start)
+                part_start = sentence_end
+            
+            sentence_start = sentence_end
         
         # Add any remaining text as the final part
-        if current_part:
-            parts.append(' '.join(current_part))
+        if part_start < len(words):
+            parts.append(' '.join(words[part_start:]))
+            word_counts.append(len(words) - part_start)
         
-        return parts
+        return parts, word_counts
     
     def send_success_response(self, data):
         """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        # orjson serializes straight to bytes, so there's no str to encode
+        payload = orjson.dumps(data)
+        send_json(self, 200, payload)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
+        payload = orjson.dumps({"error": error_message})
+        send_json(self, status_code, payload)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
\ No newline at end of file
+        send_headers(self, 200, PREFLIGHT_HEADERS)
\ No newline at end of file
@@ -1,15 +1,480 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import gzip
+import orjson
 import os
+import random
+import re
 import sys
+import time
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import requests
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from api._http import PREFLIGHT_HEADERS, read_body, send_headers, send_json
+
+# Upper bound on concurrent translation requests per batch
+_TRANSLATE_WORKERS = 8
+
+# Largest request body accepted, checked against Content-Length up front
+_MAX_BODY_BYTES = 10 << 20
+
+# Splits text after sentence-ending punctuation in a single pass, keeping
+# the punctuation with its sentence
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+def _pack_chunks(pieces, max_bytes):
+    """
+    Greedily join pieces with spaces into chunks of at most max_bytes UTF-8
+    bytes. A piece that is too long on its own is split on word boundaries;
+    only a single word longer than the limit is passed through as is.
+    """
+    chunk = []
+    size = -1
+    for piece in pieces:
+        piece = piece.strip()
+        if not piece:
+            continue
+        piece_size = len(piece.encode("utf-8"))
+        if piece_size > max_bytes and ' ' in piece:
+            if chunk:
+                yield ' '.join(chunk)
+                chunk = []
+                size = -1
+            yield from _pack_chunks(piece.split(), max_bytes)
+            continue
+        if chunk and size + 1 + piece_size > max_bytes:
+            yield ' '.join(chunk)
+            chunk = []
+            size = -1
+        chunk.append(piece)
+        size += 1 + piece_size
+    if chunk:
+        yield ' '.join(chunk)
+
+# Shortest common opening passage worth translating separately
+_MIN_SHARED_PREFIX = 100
+
+def _shared_prefix(texts):
+    """
+    Return the longest opening passage, ending on a sentence boundary, that
+    all texts share, or "" if it is shorter than _MIN_SHARED_PREFIX.
+    """
+    common = os.path.commonprefix(texts)
+    if len(common) < _MIN_SHARED_PREFIX:
+        return ""
+    boundary = None
+    for boundary in _SENTENCE_SPLIT.finditer(common):
+        pass
+    if boundary is None or boundary.start() < _MIN_SHARED_PREFIX:
+        return ""
+    return common[:boundary.start()]
+
+# HTTP (connect, read) timeouts: a dead host fails within seconds while a
+# normal translation still has time to come back
+_HTTP_TIMEOUT = (3, 15)
+
+# Wall-clock budget for translating a batch, kept under the function's
+# 25 s maxDuration so a stuck service ends in a 504 rather than a kill
+_BATCH_BUDGET_SECONDS = 22
+
+# Public LibreTranslate instance and its per-text length limit
+_LIBRETRANSLATE_URL = "https://libretranslate.com/translate"
+_LIBRETRANSLATE_MAX_CHARS = 5000
+
+# Longest text MyMemory is used for by default: 8 requests of 500 bytes
+_MYMEMORY_MAX_TEXT_BYTES = 4000
+
+# Concurrent chunk requests within a single long part
+_CHUNK_WORKERS = 4
+
+# Shared session so warm invocations reuse TLS connections; transient
+# gateway errors are retried with backoff, while the final error response
+# is still returned to the caller's own status handling
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(
+    pool_maxsize=_TRANSLATE_WORKERS * _CHUNK_WORKERS,
+    max_retries=Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False
+    )
+))
+
+# googletrans Translators, one per worker thread, so each keeps its HTTP
+# client and connections to Google alive across the parts it translates
+_THREAD_LOCAL = threading.local()
+
+def _google_translator():
+    """Return this thread's googletrans Translator, creating it on first use"""
+    translator = getattr(_THREAD_LOCAL, "translator", None)
+    if translator is None:
+        # Imported here so a broken googletrans install only disables this
+        # method, leaving the other services as fallbacks
+        from googletrans import Translator
+        translator = _THREAD_LOCAL.translator = Translator()
+    return translator
+
+# Rate limiting (429) and internal errors (500) are retried here with
+# jittered exponential backoff; 502-504 are already retried by the session.
+# A Retry-After longer than _RETRY_MAX_DELAY is not waited out, since the
+# next service in the chain is the quicker way forward.
+_RETRY_STATUSES = frozenset({429, 500})
+_RETRY_ATTEMPTS = 3
+_RETRY_BASE_DELAY = 0.3
+_RETRY_MAX_DELAY = 2.0
+
+def _with_retry(send):
+    """Call send() for a response, retrying retryable statuses"""
+    for attempt in range(_RETRY_ATTEMPTS):
+        response = send()
+        if response.status_code not in _RETRY_STATUSES or attempt == _RETRY_ATTEMPTS - 1:
+            return response
+        delay = _RETRY_BASE_DELAY * (2 ** attempt) + random.random() * 0.1
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                pass
+        if delay > _RETRY_MAX_DELAY:
+            return response
+        print(f"Upstream returned {response.status_code}, retrying in {delay:.1f}s", file=sys.stderr)
+        time.sleep(delay)
+
+# Single-request translations per service, memoized per process so chunks
+# repeated across parts and batches (intros, outros, sponsor reads) skip the
+# network. Failures raise and so are never cached.
+_CHUNK_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=_CHUNK_CACHE_SIZE)
+def _google_translate(text):
+    """Translate one chunk with googletrans"""
+    translated = _google_translator().translate(text, src='en', dest='tl').text
+    if not translated:
+        raise Exception("Google Translate returned an empty translation")
+    return translated
+
+@lru_cache(maxsize=_CHUNK_CACHE_SIZE)
+def _libretranslate(text):
+    """Translate one chunk with LibreTranslate"""
+    payload = {
+        "q": text,
+        "source": "en",
+        "target": "tl",
+        "format": "text"
+    }
+    
+    response = _with_retry(lambda: _SESSION.post(_LIBRETRANSLATE_URL, json=payload, timeout=_HTTP_TIMEOUT))
+    response.raise_for_status()
+    
+    data = response.json()
+    translated = data.get("translatedText")
+    if translated:
+        return translated
+    
+    # A 200 without a translation is a failure, not an empty result: raising
+    # moves on to the next service and keeps "" out of every cache tier
+    raise Exception(f"LibreTranslate API error: {data.get('error', 'No translatedText in response')}")
+
+@lru_cache(maxsize=_CHUNK_CACHE_SIZE)
+def _mymemory_translate(text):
+    """Translate one chunk (at most 500 bytes) with MyMemory"""
+    # requests encodes the query itself, so the text isn't quoted twice
+    response = _with_retry(lambda: _SESSION.get(
+        "https://api.mymemory.translated.net/get",
+        params={"q": text, "langpair": "en|tl"},
+        timeout=_HTTP_TIMEOUT
+    ))
+    response.raise_for_status()
+    
+    data = response.json()
+    
+    if data.get("responseStatus") == 200 or data.get("responseStatus") == "200":
+        translated = data.get("responseData", {}).get("translatedText", "")
+        if translated:
+            return translated
+    
+    raise Exception(f"MyMemory API error: {data.get('responseDetails', 'Unknown error')}")
+
+# Translation services to try, in order, as (name, handler method). Chosen
+# once at import from TRANSLATE_PROVIDERS (comma-separated keys of
+# _SERVICE_METHODS); a service left out is never called, and googletrans is
+# then never imported.
+_SERVICE_METHODS = {
+    "google": ("Google Translate", "translate_with_google"),
+    "libre": ("LibreTranslate", "translate_with_libretranslate"),
+    "mymemory": ("MyMemory", "translate_with_mymemory"),
+}
+
+def _configured_services():
+    """Parse TRANSLATE_PROVIDERS, falling back to all services on bad input"""
+    services = []
+    for key in os.environ.get("TRANSLATE_PROVIDERS", "google,libre,mymemory").split(","):
+        key = key.strip().lower()
+        if key in _SERVICE_METHODS and _SERVICE_METHODS[key] not in services:
+            services.append(_SERVICE_METHODS[key])
+        elif key:
+            print(f"Ignoring unknown translation provider: {key}", file=sys.stderr)
+    return tuple(services) or tuple(_SERVICE_METHODS.values())
+
+_SERVICES = _configured_services()
+
+# Per-service circuit breakers. After _CIRCUIT_FAIL_MAX consecutive failures
+# a service is skipped for _CIRCUIT_RESET_SECONDS, so an outage costs one
+# timeout per cool-down rather than one per part. After the cool-down the
+# circuit is half-open: exactly one caller claims a trial call, everyone else
+# keeps skipping the service until the trial closes or reopens the circuit.
+# A trial that never reports back (e.g. the instance was frozen mid-call)
+# lapses after another cool-down so the circuit can't stay stuck.
+_CIRCUIT_FAIL_MAX = 3
+_CIRCUIT_RESET_SECONDS = 30
+_CIRCUITS = {}
+_CIRCUIT_LOCK = threading.Lock()
+
+def _circuit_ready(state, now):
+    """Whether a circuit's state admits a call (caller holds _CIRCUIT_LOCK)"""
+    if state is None:
+        return True
+    failures, open_until, trial_started = state
+    if failures < _CIRCUIT_FAIL_MAX:
+        return True
+    return now >= open_until and now >= trial_started + _CIRCUIT_RESET_SECONDS
+
+def _circuit_available(name):
+    """Whether the named service would be tried now, without claiming a trial"""
+    with _CIRCUIT_LOCK:
+        return _circuit_ready(_CIRCUITS.get(name), time.monotonic())
+
+def _circuit_allows(name):
+    """
+    Whether a call to the named service may be attempted. On a half-open
+    circuit this claims the single trial call, which the caller must
+    resolve with _circuit_record.
+    """
+    with _CIRCUIT_LOCK:
+        state = _CIRCUITS.get(name)
+        now = time.monotonic()
+        if not _circuit_ready(state, now):
+            return False
+        if state is not None and state[0] >= _CIRCUIT_FAIL_MAX:
+            print(f"{name} circuit OPEN -> HALF-OPEN", file=sys.stderr)
+            _CIRCUITS[name] = (state[0], state[1], now)
+        return True
+
+def _circuit_record(name, succeeded):
+    """Record a call outcome, opening or closing the service's circuit"""
+    with _CIRCUIT_LOCK:
+        failures, open_until, trial_started = _CIRCUITS.get(name, (0, 0.0, 0.0))
+        if succeeded:
+            if failures >= _CIRCUIT_FAIL_MAX:
+                print(f"{name} circuit HALF-OPEN -> CLOSED", file=sys.stderr)
+            _CIRCUITS.pop(name, None)
+            return
+        failures += 1
+        if failures >= _CIRCUIT_FAIL_MAX:
+            if failures == _CIRCUIT_FAIL_MAX:
+                print(f"{name} circuit CLOSED -> OPEN", file=sys.stderr)
+            elif trial_started:
+                print(f"{name} circuit HALF-OPEN -> OPEN", file=sys.stderr)
+            open_until = time.monotonic() + _CIRCUIT_RESET_SECONDS
+        # Any failure also ends a trial in progress, reopening the circuit
+        _CIRCUITS[name] = (failures, open_until, 0.0)
+
+# Per-process LRU of finished translations, keyed by a digest of the source
+# text so repeated intros and sponsor reads skip the services entirely
+_CACHE_SIZE = 4096
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+def _cache_key(text):
+    """Fixed-size key for a source text"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+# Optional shared tier so cold instances also see earlier translations;
+# enabled when a Redis URL is configured and the redis package is present.
+# A fixed text's translation doesn't go stale, so entries live for 30 days.
+_REDIS_URL = os.environ.get("REDIS_URL") or os.environ.get("KV_URL")
+_REDIS_TTL = 30 * 24 * 60 * 60
+_REDIS_KEY_PREFIX = b"tr:en|tl:"
+_redis = None
+_redis_unavailable = not _REDIS_URL
+
+def _redis_client():
+    """Return the shared Redis client, or None when it isn't usable"""
+    global _redis, _redis_unavailable
+    if _redis is None and not _redis_unavailable:
+        try:
+            import redis
+            _redis = redis.Redis.from_url(
+                _REDIS_URL,
+                socket_timeout=2,
+                socket_connect_timeout=2,
+                max_connections=_TRANSLATE_WORKERS + 2
+            )
+        except Exception as e:
+            print(f"Redis cache disabled: {str(e)}", file=sys.stderr)
+            _redis_unavailable = True
+    return _redis
+
+# On-disk tier in /tmp, which outlives the process for as long as the
+# container is kept, so a restarted worker starts with a warm cache
+_DB_PATH = os.path.join(tempfile.gettempdir(), "translations.db")
+_db = None
+_db_unavailable = False
+_DB_LOCK = threading.Lock()
+
+def _translation_db():
+    """Return the SQLite connection, opening it on first use, or None"""
+    global _db, _db_unavailable
+    if _db is None and not _db_unavailable:
+        try:
+            db = sqlite3.connect(_DB_PATH, isolation_level=None, check_same_thread=False, timeout=2)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS translations (k BLOB PRIMARY KEY, v TEXT NOT NULL)")
+            _db = db
+        except sqlite3.Error as e:
+            print(f"SQLite cache disabled: {str(e)}", file=sys.stderr)
+            _db_unavailable = True
+    return _db
+
+def _db_get_many(keys):
+    """Look up keys in the SQLite tier; returns a dict of those found"""
+    db = _translation_db()
+    if db is None or not keys:
+        return {}
+    try:
+        with _DB_LOCK:
+            rows = db.execute(
+                f"SELECT k, v FROM translations WHERE k IN ({','.join('?' * len(keys))})",
+                keys
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"SQLite lookup failed: {str(e)}", file=sys.stderr)
+        return {}
+    return {bytes(k): v for k, v in rows}
+
+def _db_put(key, translated):
+    """Store a translation in the SQLite tier"""
+    db = _translation_db()
+    if db is None:
+        return
+    try:
+        with _DB_LOCK:
+            db.execute("INSERT OR REPLACE INTO translations (k, v) VALUES (?, ?)", (key, translated))
+    except sqlite3.Error as e:
+        print(f"SQLite store failed: {str(e)}", file=sys.stderr)
+
+def _cache_get_many(keys):
+    """
+    Look up translations for the given keys, in-process first, then in
+    SQLite, then in Redis with a single MGET. Returns a dict of the keys
+    that were found; lower-tier hits are copied into the tiers above.
+    """
+    found = {}
+    missing = []
+    with _CACHE_LOCK:
+        for key in keys:
+            translated = _CACHE.get(key)
+            if translated is not None:
+                _CACHE.move_to_end(key)
+                found[key] = translated
+            else:
+                missing.append(key)
+    
+    if missing:
+        for key, translated in _db_get_many(missing).items():
+            found[key] = translated
+            _cache_put_local(key, translated)
+        missing = [key for key in missing if key not in found]
+    
+    client = _redis_client() if missing else None
+    if client is not None:
+        try:
+            values = client.mget([_REDIS_KEY_PREFIX + key for key in missing])
+        except Exception as e:
+            print(f"Redis lookup failed: {str(e)}", file=sys.stderr)
+            values = ()
+        for key, value in zip(missing, values):
+            if value is not None:
+                found[key] = value.decode("utf-8")
+                _cache_put_local(key, found[key])
+                _db_put(key, found[key])
+    return found
+
+def _cache_put_local(key, translated):
+    """Store a translation, evicting the least recently used entry"""
+    with _CACHE_LOCK:
+        _CACHE[key] = translated
+        _CACHE.move_to_end(key)
+        if len(_CACHE) > _CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+def _cache_put(key, translated):
+    """Store a translation in every cache tier that's available"""
+    _cache_put_local(key, translated)
+    _db_put(key, translated)
+    client = _redis_client()
+    if client is not None:
+        try:
+            client.setex(_REDIS_KEY_PREFIX + key, _REDIS_TTL, translated.encode("utf-8"))
+        except Exception as e:
+            print(f"Redis store failed: {str(e)}", file=sys.stderr)
+
+# Translated batches are several KB of text and gzip to a fraction of that;
+# small payloads aren't worth the header and CPU
+_GZIP_MIN_BYTES = 1024
+_GZIP_LEVEL = 5
+
+def _accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows a gzip response. An explicit
+    gzip entry decides on its own; otherwise a '*' entry does. Either one
+    with a q-value of zero (or an unparseable one) refuses gzip.
+    """
+    weights = {}
+    for coding in accept_encoding.lower().split(","):
+        name, *params = coding.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip()] = q
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+# Headers added to gzipped responses, and the headers of streamed responses
+_GZIP_HEADERS = (("Content-Encoding", "gzip"), ("Vary", "Accept-Encoding"))
+_NDJSON_HEADERS = (("Content-Type", "application/x-ndjson"), ("Access-Control-Allow-Origin", "*"))
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
+        deadline = time.monotonic() + _BATCH_BUDGET_SECONDS
+        # Set once the NDJSON status line and headers are sent
+        self.streaming = False
         try:
             # Read JSON body
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
+            # Refuse oversized scripts before allocating a buffer for them
+            if content_length > _MAX_BODY_BYTES:
+                self.send_error_response(413, f"Request body too large: {content_length} bytes (max {_MAX_BODY_BYTES})")
+                return
+            # orjson parses the bytearray directly, without a str copy
+            body = read_body(self.rfile, content_length)
+            data = orjson.loads(body)
+            # Only the parsed parts are needed from here on
+            del body
             
             # Validate input
             if "parts" not in data:
@@ -19,47 +484,152 @@ class handler(BaseHTTPRequestHandler):
             parts = data["parts"]
             batch_index = data.get("batch_index", 0)  # Which batch to process
             batch_size = data.get("batch_size", 10)   # Parts per batch (default 10)
+            # Let MyMemory chunk long parts into many small requests
+            allow_long_mymemory = bool(data.get("allow_mymemory_chunking", False))
+            # Stream each part as NDJSON as soon as it's ready
+            stream = bool(data.get("stream", False))
             
             if not isinstance(parts, list):
                 self.send_error_response(400, "'parts' must be an array")
                 return
             
-            if len(parts) == 0:
+            total_parts = len(parts)
+            if total_parts == 0:
                 self.send_error_response(400, "Parts array cannot be empty")
                 return
             
             # Calculate batch range
             start_idx = batch_index * batch_size
-            end_idx = min(start_idx + batch_size, len(parts))
+            end_idx = min(start_idx + batch_size, total_parts)
             batch_parts = parts[start_idx:end_idx]
             
-            print(f"Processing batch {batch_index + 1}: parts {start_idx + 1} to {end_idx} of {len(parts)}", file=sys.stderr)
+            print(f"Processing batch {batch_index + 1}: parts {start_idx + 1} to {end_idx} of {total_parts}", file=sys.stderr)
             
-            # Translate batch
+            # Translate batch. Each part is a blocking round trip to a
+            # translation service, so the whole batch is requested
+            # concurrently; results are still checked in part order.
             translated_batch = []
+            skipped_services = set()
             
-            for i, part in enumerate(batch_parts):
-                actual_index = start_idx + i
-                if not part or not part.strip():
-                    translated_batch.append("")
-                    continue
+            # Parts already translated are served from the cache, and
+            # duplicates within the batch share a single request. The pool
+            # is shut down without waiting so an early error response isn't
+            # held back by parts still in flight.
+            executor = ThreadPoolExecutor(max_workers=_TRANSLATE_WORKERS)
+            try:
+                futures = {}
+                cached = {}
+                keys = {}
+                pending = {}
+                for i, part in enumerate(batch_parts):
+                    if part and not part.isspace():
+                        keys[i] = _cache_key(part)
+                hits = _cache_get_many(set(keys.values()))
                 
-                try:
-                    print(f"Translating part {actual_index + 1}/{len(parts)}...", file=sys.stderr)
-                    translated = self.translate_text(part)
-                    translated_batch.append(translated)
-                    print(f"Part {actual_index + 1} translated successfully", file=sys.stderr)
-                except Exception as e:
-                    print(f"Part {actual_index + 1} failed: {str(e)}", file=sys.stderr)
-                    self.send_error_response(500, f"Translation failed at part {actual_index + 1}: {str(e)}")
-                    return
-            
-            # Calculate statistics for this batch
-            batch_original_chars = sum(len(part) for part in batch_parts)
-            batch_translated_chars = sum(len(part) for part in translated_batch)
+                # When LibreTranslate is the first service that would be
+                # tried (Google disabled or known to be down), it would be
+                # asked for every part anyway, so the remaining parts go to
+                # it in a single request; anything it doesn't return falls
+                # through to the per-part chain below
+                first_service = next((name for name, _ in _SERVICES if _circuit_available(name)), None)
+                if first_service == "LibreTranslate":
+                    uncached = {}
+                    for i, key in keys.items():
+                        if key not in hits and len(batch_parts[i]) <= _LIBRETRANSLATE_MAX_CHARS:
+                            uncached.setdefault(key, batch_parts[i])
+                    if len(uncached) > 1 and _circuit_allows("LibreTranslate"):
+                        # Run on the pool so the wait is bounded by the
+                        # batch deadline like every per-part request
+                        batch_future = executor.submit(self.translate_batch_with_libretranslate, list(uncached.values()))
+                        try:
+                            translated = batch_future.result(timeout=max(0, deadline - time.monotonic()))
+                            _circuit_record("LibreTranslate", True)
+                            for key, text in zip(uncached, translated):
+                                if text:
+                                    hits[key] = text
+                                    _cache_put(key, text)
+                        except FutureTimeoutError:
+                            print("LibreTranslate batch timed out", file=sys.stderr)
+                            _circuit_record("LibreTranslate", False)
+                            self.send_error_response(504, "Translation timed out waiting for the LibreTranslate batch")
+                            return
+                        except Exception as e:
+                            print(f"LibreTranslate batch failed: {str(e)}", file=sys.stderr)
+                            _circuit_record("LibreTranslate", False)
+                
+                # Parts that all open with the same long passage (a series
+                # intro or sponsor read) have it translated only once, and
+                # each part then only sends what follows it
+                uncached = {key: batch_parts[i] for i, key in keys.items() if key not in hits}
+                prefix = _shared_prefix(list(uncached.values())) if len(uncached) > 1 else ""
+                if prefix:
+                    print(f"Translating {len(prefix)} char prefix shared by {len(uncached)} parts once", file=sys.stderr)
+                    prefix_future = executor.submit(self.translate_text, prefix, allow_long_mymemory, skipped_services)
+                
+                # Each part maps to the futures whose results, joined, make
+                # up its translation
+                for i, key in keys.items():
+                    part = batch_parts[i]
+                    if key in hits:
+                        cached[i] = hits[key]
+                    elif key in pending:
+                        futures[i] = pending[key]
+                    else:
+                        print(f"Translating part {start_idx + i + 1}/{total_parts}...", file=sys.stderr)
+                        if prefix:
+                            suffix = part[len(prefix):].strip()
+                            futures[i] = [prefix_future]
+                            if suffix:
+                                futures[i].append(executor.submit(self.translate_text, suffix, allow_long_mymemory, skipped_services))
+                        else:
+                            futures[i] = [executor.submit(self.translate_text, part, allow_long_mymemory, skipped_services)]
+                        pending[key] = futures[i]
+                
+                # Character statistics are tallied as results are collected
+                batch_original_chars = 0
+                batch_translated_chars = 0
+                if stream:
+                    self.start_ndjson_response()
+                for i, part in enumerate(batch_parts):
+                    actual_index = start_idx + i
+                    batch_original_chars += len(part)
+                    if i in cached:
+                        translated_batch.append(cached[i])
+                        batch_translated_chars += len(cached[i])
+                        if stream:
+                            self.write_ndjson_line({"index": actual_index, "text": cached[i]})
+                        print(f"Part {actual_index + 1} served from cache", file=sys.stderr)
+                        continue
+                    if i not in futures:
+                        translated_batch.append("")
+                        if stream:
+                            self.write_ndjson_line({"index": actual_index, "text": ""})
+                        continue
+                    
+                    try:
+                        translated = ' '.join(
+                            future.result(timeout=max(0, deadline - time.monotonic()))
+                            for future in futures[i]
+                        )
+                        _cache_put(keys[i], translated)
+                        translated_batch.append(translated)
+                        batch_translated_chars += len(translated)
+                        if stream:
+                            self.write_ndjson_line({"index": actual_index, "text": translated})
+                        print(f"Part {actual_index + 1} translated successfully", file=sys.stderr)
+                    except FutureTimeoutError:
+                        print(f"Part {actual_index + 1} timed out", file=sys.stderr)
+                        self.send_batch_error(504, f"Translation timed out at part {actual_index + 1}")
+                        return
+                    except Exception as e:
+                        print(f"Part {actual_index + 1} failed: {str(e)}", file=sys.stderr)
+                        self.send_batch_error(500, f"Translation failed at part {actual_index + 1}: {str(e)}")
+                        return
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
             
             # Determine if more batches remain
-            has_more = end_idx < len(parts)
+            has_more = end_idx < total_parts
             
             response_data = {
                 "translated_batch": translated_batch,
@@ -67,45 +637,68 @@ class handler(BaseHTTPRequestHandler):
                 "batch_size": batch_size,
                 "batch_start": start_idx,
                 "batch_end": end_idx,
-                "total_parts": len(parts),
+                "total_parts": total_parts,
                 "has_more": has_more,
                 "next_batch_index": batch_index + 1 if has_more else None,
                 "original_chars": batch_original_chars,
-                "translated_chars": batch_translated_chars
+                "translated_chars": batch_translated_chars,
+                "service_skipped": sorted(skipped_services),
+                # Share of the batch's parts that needed their own lookup or
+                # translation once duplicates and blanks were folded
+                "dedup_ratio": round(len(set(keys.values())) / len(batch_parts), 3) if batch_parts else 1.0
             }
             
-            self.send_success_response(response_data)
+            if stream:
+                # The parts were already sent; finish with the batch summary
+                del response_data["translated_batch"]
+                self.write_ndjson_line(response_data)
+            else:
+                self.send_success_response(response_data)
             
         except json.JSONDecodeError as e:
             self.send_error_response(400, f"Invalid JSON: {str(e)}")
         except Exception as e:
-            self.send_error_response(500, f"Unexpected error: {str(e)}")
+            self.send_batch_error(500, f"Unexpected error: {str(e)}")
     
-    def translate_text(self, text):
+    def translate_text(self, text, allow_long_mymemory=False, skipped=None):
         """
         Translate English text to Filipino (Tagalog).
-        Uses multiple free translation services.
+        Uses multiple free translation services. Services passed over are
+        added to the 'skipped' set, if one is given.
         """
-        # Method 1: Google Translate (via googletrans library - most reliable)
-        try:
-            print("Trying Google Translate...", file=sys.stderr)
-            return self.translate_with_google(text)
-        except Exception as e:
-            print(f"Google Translate failed: {str(e)}", file=sys.stderr)
-        
-        # Method 2: LibreTranslate public API
-        try:
-            print("Trying LibreTranslate...", file=sys.stderr)
-            return self.translate_with_libretranslate(text)
-        except Exception as e:
-            print(f"LibreTranslate failed: {str(e)}", file=sys.stderr)
-        
-        # Method 3: MyMemory API
-        try:
-            print("Trying MyMemory...", file=sys.stderr)
-            return self.translate_with_mymemory(text)
-        except Exception as e:
-            print(f"MyMemory failed: {str(e)}", file=sys.stderr)
+        # Services in the configured order, by default Google Translate (via
+        # googletrans library - most reliable), then the LibreTranslate public
+        # API, then MyMemory. A service whose circuit is open is skipped
+        # instead of waiting out its timeout again.
+        # MyMemory is also skipped for long texts, which would fan out into
+        # many 500 byte requests, unless the caller opted in.
+        too_long_for_mymemory = (
+            not allow_long_mymemory
+            and len(text.encode("utf-8")) > _MYMEMORY_MAX_TEXT_BYTES
+        )
+        for name, method_name in _SERVICES:
+            translate = getattr(self, method_name)
+            # Checked before the circuit, so a skipped call never claims
+            # (and strands) a half-open circuit's trial
+            if name == "MyMemory" and too_long_for_mymemory:
+                print(f"Skipping {name}: text longer than {_MYMEMORY_MAX_TEXT_BYTES} bytes", file=sys.stderr)
+                if skipped is not None:
+                    skipped.add(name)
+                continue
+            if not _circuit_allows(name):
+                print(f"Skipping {name}: circuit open", file=sys.stderr)
+                if skipped is not None:
+                    skipped.add(name)
+                continue
+            try:
+                print(f"Trying {name}...", file=sys.stderr)
+                translated = translate(text)
+            except Exception as e:
+                print(f"{name} failed: {str(e)}", file=sys.stderr)
+                _circuit_record(name, False)
+                continue
+            _circuit_record(name, True)
+            return translated
         
         # If all methods fail
         raise Exception("All translation services failed. The text may be too long or services are temporarily unavailable.")
@@ -114,46 +707,19 @@ class handler(BaseHTTPRequestHandler):
         """
         Use Google Translate via googletrans library (unofficial but free and reliable).
         """
-        from googletrans import Translator
-        import time
-        
-        translator = Translator()
-        
         # Google Translate can handle long text, but we'll chunk for safety
         max_chunk_size = 5000  # characters
         
         if len(text) <= max_chunk_size:
-            result = translator.translate(text, src='en', dest='tl')
-            return result.text
+            return _google_translate(text)
         
-        # Split into chunks by sentences
-        sentences = text.replace('! ', '!|').replace('? ', '?|').replace('. ', '.|').split('|')
+        # Split into chunks by sentences, pausing between requests to
+        # avoid rate limits
         translated_chunks = []
-        current_chunk = []
-        current_length = 0
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            if current_length + len(sentence) > max_chunk_size and current_chunk:
-                # Translate current chunk
-                chunk_text = ' '.join(current_chunk)
-                result = translator.translate(chunk_text, src='en', dest='tl')
-                translated_chunks.append(result.text)
-                current_chunk = [sentence]
-                current_length = len(sentence)
-                time.sleep(0.5)  # Small delay to avoid rate limits
-            else:
-                current_chunk.append(sentence)
-                current_length += len(sentence) + 1
-        
-        # Translate remaining chunk
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            result = translator.translate(chunk_text, src='en', dest='tl')
-            translated_chunks.append(result.text)
+        for chunk_text in _pack_chunks(_SENTENCE_SPLIT.split(text), max_chunk_size):
+            if translated_chunks:
+                time.sleep(0.5)
+            translated_chunks.append(_google_translate(chunk_text))
         
         return ' '.join(translated_chunks)
     
@@ -161,151 +727,120 @@ class handler(BaseHTTPRequestHandler):
         """
         Use LibreTranslate public API (free, open-source).
         """
-        import requests
-        
-        # Public LibreTranslate instance
-        url = "https://libretranslate.com/translate"
-        
         # Split text if too long (LibreTranslate has limits)
-        max_chunk_size = 5000
+        max_chunk_size = _LIBRETRANSLATE_MAX_CHARS
         
         if len(text) <= max_chunk_size:
-            payload = {
-                "q": text,
-                "source": "en",
-                "target": "tl",
-                "format": "text"
-            }
-            
-            response = requests.post(url, json=payload, timeout=60)
-            response.raise_for_status()
-            
-            data = response.json()
-            return data.get("translatedText", "")
+            return _libretranslate(text)
         
-        # Split into chunks
-        sentences = text.replace('! ', '!|').replace('? ', '?|').replace('. ', '.|').split('|')
-        translated_chunks = []
-        current_chunk = []
-        current_length = 0
+        # Split into chunks and send them concurrently; map() keeps the
+        # chunk order
+        chunks = _pack_chunks(_SENTENCE_SPLIT.split(text), max_chunk_size)
+        with ThreadPoolExecutor(max_workers=_CHUNK_WORKERS) as executor:
+            return ' '.join(executor.map(_libretranslate, chunks))
+    
+    def translate_batch_with_libretranslate(self, texts):
+        """
+        Translate several short texts with as few LibreTranslate requests as
+        possible. 'q' may be an array, answered in the same order, but the
+        character limit applies to the whole array, so texts are grouped to
+        stay within it and the groups are sent concurrently.
+        """
+        groups = []
+        group = []
+        group_chars = 0
+        for text in texts:
+            if group and group_chars + len(text) > _LIBRETRANSLATE_MAX_CHARS:
+                groups.append(group)
+                group = []
+                group_chars = 0
+            group.append(text)
+            group_chars += len(text)
+        if group:
+            groups.append(group)
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            if current_length + len(sentence) > max_chunk_size and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                payload = {
-                    "q": chunk_text,
-                    "source": "en",
-                    "target": "tl",
-                    "format": "text"
-                }
-                response = requests.post(url, json=payload, timeout=60)
-                response.raise_for_status()
-                data = response.json()
-                translated_chunks.append(data.get("translatedText", ""))
-                current_chunk = [sentence]
-                current_length = len(sentence)
-            else:
-                current_chunk.append(sentence)
-                current_length += len(sentence) + 1
+        with ThreadPoolExecutor(max_workers=_TRANSLATE_WORKERS) as executor:
+            results = list(executor.map(self._translate_group_libretranslate, groups))
+        return [translated for result in results for translated in result]
+    
+    def _translate_group_libretranslate(self, texts):
+        """Helper to translate one array of texts with LibreTranslate"""
+        payload = {
+            "q": texts,
+            "source": "en",
+            "target": "tl",
+            "format": "text"
+        }
         
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            payload = {
-                "q": chunk_text,
-                "source": "en",
-                "target": "tl",
-                "format": "text"
-            }
-            response = requests.post(url, json=payload, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-            translated_chunks.append(data.get("translatedText", ""))
+        response = _with_retry(lambda: _SESSION.post(_LIBRETRANSLATE_URL, json=payload, timeout=_HTTP_TIMEOUT))
+        response.raise_for_status()
         
-        return ' '.join(translated_chunks)
+        translated = response.json().get("translatedText")
+        if not isinstance(translated, list) or len(translated) != len(texts):
+            raise Exception("LibreTranslate batch response did not match the request")
+        return translated
     
     def translate_with_mymemory(self, text):
         """
         Use MyMemory Translation API (free, no auth required).
         """
-        import requests
-        from urllib.parse import quote
-        
-        # Split text into chunks (MyMemory has 500 char limit)
+        # Split text into chunks (MyMemory limits a query to 500 bytes)
         max_chars = 500
         
-        if len(text) <= max_chars:
+        if len(text.encode("utf-8")) <= max_chars:
             return self._translate_chunk_mymemory(text)
         
-        # Split into sentences and translate in chunks
-        sentences = text.replace('! ', '!|').replace('? ', '?|').replace('. ', '.|').split('|')
-        translated_chunks = []
-        current_chunk = []
-        current_length = 0
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            if current_length + len(sentence) > max_chars and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                translated_chunks.append(self._translate_chunk_mymemory(chunk_text))
-                current_chunk = [sentence]
-                current_length = len(sentence)
-            else:
-                current_chunk.append(sentence)
-                current_length += len(sentence) + 1
+        # Split into sentences and pack them into chunks
+        chunks = list(_pack_chunks(_SENTENCE_SPLIT.split(text), max_chars))
         
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            translated_chunks.append(self._translate_chunk_mymemory(chunk_text))
+        # The 500 byte limit turns a long part into many small requests,
+        # so they're sent concurrently; map() keeps the chunk order
+        with ThreadPoolExecutor(max_workers=_CHUNK_WORKERS) as executor:
+            translated_chunks = list(executor.map(self._translate_chunk_mymemory, chunks))
         
         return ' '.join(translated_chunks)
     
     def _translate_chunk_mymemory(self, text):
         """Helper to translate a single chunk with MyMemory API"""
-        import requests
-        from urllib.parse import quote
-        
-        encoded_text = quote(text)
-        url = f"https://api.mymemory.translated.net/get?q={encoded_text}&langpair=en|tl"
-        
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if data.get("responseStatus") == 200 or data.get("responseStatus") == "200":
-            translated = data.get("responseData", {}).get("translatedText", "")
-            if translated:
-                return translated
-        
-        raise Exception(f"MyMemory API error: {data.get('responseDetails', 'Unknown error')}")
+        return _mymemory_translate(text)
     
     def send_success_response(self, data):
-        """Send successful JSON response"""
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        """Send successful JSON response, gzipped when the client accepts it"""
+        # orjson serializes straight to bytes, so there's no str to encode
+        payload = orjson.dumps(data)
+        if len(payload) >= _GZIP_MIN_BYTES and _accepts_gzip(self.headers.get("Accept-Encoding", "")):
+            send_json(self, 200, gzip.compress(payload, compresslevel=_GZIP_LEVEL), _GZIP_HEADERS)
+        else:
+            send_json(self, 200, payload)
     
     def send_error_response(self, status_code, error_message):
         """Send error JSON response"""
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps({"error": error_message}).encode('utf-8'))
+        payload = orjson.dumps({"error": error_message})
+        send_json(self, status_code, payload)
+    
+    def start_ndjson_response(self):
+        """
+        Start a streamed NDJSON response. It has no Content-Length and ends
+        when the connection closes, so each line can be sent as it's ready.
+        """
+        send_headers(self, 200, _NDJSON_HEADERS)
+        self.streaming = True
+    
+    def write_ndjson_line(self, data):
+        """Write one NDJSON line of a streamed response and flush it"""
+        self.wfile.write(orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE))
+        self.wfile.flush()
+    
+    def send_batch_error(self, status_code, error_message):
+        """
+        Report a failed batch; once streaming has started the status line is
+        already sent, so the error goes out as a final NDJSON line instead
+        """
+        if self.streaming:
+            self.write_ndjson_line({"error": error_message, "status": status_code})
+        else:
+            self.send_error_response(status_code, error_message)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
\ No newline at end of file
+        send_headers(self, 200, PREFLIGHT_HEADERS)
\ No newline at end of file